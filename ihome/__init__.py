@@ -38,6 +38,8 @@ def create_log(config_name):
 db = SQLAlchemy()
 
 redis_store = None  # type: StrictRedis
+# 不对返回结果解码的redis实例,用来读写压缩后的缓存等二进制数据
+redis_binary_store = None  # type: StrictRedis
 
 def create_app(config_name):
     """创建flask应用app对象"""
@@ -56,9 +58,11 @@ def create_app(config_name):
     db.init_app(app)
 
     # 2.2 创建redis实例对象及配置
-    global redis_store
+    global redis_store, redis_binary_store
     redis_store = StrictRedis(host=config[config_name].HOST, port=config[config_name].POST,
                               db=config[config_name].NUM, decode_responses=True)
+    redis_binary_store = StrictRedis(host=config[config_name].HOST, port=config[config_name].POST,
+                                     db=config[config_name].NUM)
 
     # 3 开启flask后端csrf保护机制
     csrf = CSRFProtect(app)
@@ -66,6 +70,11 @@ def create_app(config_name):
     # 4 借助第三方Session类区调整flask中session的存储位置
     Session(app)
 
+    # 调试模式下统计每个请求执行的sql次数
+    if app.debug:
+        from .utils.queries import install_query_counter
+        install_query_counter()
+
     # 为app中的url路由添加正则表达式匹配
     app.url_map.converters["regex"] = RegexConverter
 
@@ -1,17 +1,24 @@
 # -*- coding:utf-8 -*-
 from ihome import models
-from flask import Blueprint
+from flask import Blueprint, current_app
 
 api = Blueprint('api', __name__)
 
 # 把拆分出去的文件导入到创建蓝图对象的地方,和蓝图对象进行关联
-from . import register,passport,house
+from . import register,passport,house,orders
 
 # 请求钩子,在每次请求后执行,没有异常的情况下
 @api.after_request
 def after_request(response):
     """设置默认的响应报文格式为application/json"""
-    # 如果响应报文response的Content-Type是以text开头，则将其改为默认的json类型
-    if response.headers.get("Content-Type").startswith("text"):
+    # 如果响应报文response的Content-Type是text/html(make_response的默认类型)，则将其改为默认的json类型
+    # 其他text类型(如导出订单的text/csv)是接口明确指定的，保持不变
+    if response.headers.get("Content-Type", "").startswith("text/html"):
         response.headers["Content-Type"] = "application/json"
+    # 调试模式下在响应头中返回本次请求执行的sql次数,以及本进程一级缓存的命中统计
+    if current_app.debug:
+        from ihome.utils.queries import get_query_count
+        from ihome.utils import local_cache
+        response.headers["X-Query-Count"] = str(get_query_count())
+        response.headers["X-Local-Cache"] = "hits=%(hits)s misses=%(misses)s size=%(size)s" % local_cache.stats()
     return response
@@ -2,22 +2,59 @@
 # 导入蓝图
 from . import api
 # 导入redis数据库实例
-from ihome import redis_store,constants,db
+from ihome import redis_store,redis_binary_store,constants,db
 # 导入flask内置的对象
 from flask import current_app,jsonify,g,request,session
 # 导入模型类
-from ihome.models import Area,House,Facility,HouseImage,User,Order
+from ihome.models import Area,House,Facility,HouseImage,Order,house_facility
 # 导入自定义的状态码
 from ihome.utils.response_code import RET
 # 导入登陆验证装饰器
-from ihome.utils.commons import login_required
+from ihome.utils.commons import login_required,encode_cursor,decode_cursor,keyset_filter
 # 导入七牛云接口
 from ihome.utils.image_storage import storage
+# 导入房屋可预订状态位图索引
+from ihome.utils import availability
+# 导入房屋列表排序索引
+from ihome.utils import house_index
+# 导入房屋关键字搜索的倒排索引
+from ihome.utils import search
+# 导入房屋摘要缓存
+from ihome.utils import house_summary
+# 导入房屋评论缓存
+from ihome.utils import comments
+# 导入房屋完成订单数的计数器
+from ihome.utils import order_counter
+# 导入预先加载关联对象的查询
+from ihome.utils.queries import house_basic_query,house_full_query,house_comments
+# 导入缓存设施
+from ihome.utils.cache import houses_list_key,invalidate_houses_list,single_flight
+from ihome.utils.cache import get_with_freshness,set_with_freshness,refresh_in_background
+from ihome.utils.cache import etag_key,make_etag,is_not_modified,not_modified,etag_response
+from ihome.utils.cache import get_compressed,compressed_response,record_hit
+# 导入进程内的一级缓存
+from ihome.utils import local_cache
+# 导入缓存数据的编码
+from ihome.utils import codec
 
+# 导入sqlalchemy的or_
+from sqlalchemy import or_
 # 导入json
 import json
 # 导入日期模块
 import datetime
+import calendar
+
+# 房屋列表的排序条件对应的排序字段,以及是否降序
+HOUSE_LIST_SORTS = {
+    # 按成交次数排序;数据库中的order_count由flush_order_count定时写入,未构建排序索引时排序会滞后于最新的评价
+    'booking':(House.order_count,True),
+    'price-inc':(House.price,False), # 按价格升序排序
+    'price-des':(House.price,True), # 按价格降序排序
+    'new':(House.create_time,True), # 默认排序,按照房屋的发布时间进行排序
+}
+# 游标中发布时间的格式
+CURSOR_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
 
 @api.route('/areas',methods=['GET'])
 def get_areas_info():
@@ -40,41 +77,95 @@ def get_areas_info():
       return resp
     :return:
     """
+    # 首先从进程内的一级缓存中获取城区信息和ETag,命中时不需要访问redis
+    cached = local_cache.get('area_info')
+    if cached:
+        areas,etag = cached
+        return etag_response('{"errno":0,"errmsg":"OK","data":%s}' %areas,etag)
     # 尝试从redis中获取城区信息
     try:
-        areas = redis_store.get('area_info')
+        # 客户端带有If-None-Match时,先只读取ETag进行比较,一致时直接返回304
+        if request.if_none_match:
+            etag = redis_store.get(etag_key('area_info'))
+            if is_not_modified(etag):
+                return not_modified(etag)
+        areas,etag = redis_binary_store.mget('area_info',etag_key('area_info'))
+        areas,etag = codec.decode(areas),etag and etag.decode('utf-8')
     except Exception as e:
         current_app.logger.error(e)
-        areas = None
+        areas,etag = None,None
     # 判断获取结果,如果有数据,留下访问redis数据的记录
     if areas:
         current_app.logger.info('hit redis areas info')
+        etag = etag or make_etag(areas)
+        local_cache.set('area_info',(areas,etag))
         # 因为redis中存储的已经是json字符串,可以直接返回
-        return '{"errno":0,"errmsg":"OK","data":%s}' %areas
-    # 如果缓存中没有数据,需要读取mysql数据库
-    try:
-        areas = Area.query.all()
-    except Exception as e:
-        current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR,errmsg='查询城区信息异常')
-    # 判断查询结果
-    if not areas:
-        return jsonify(errno=RET.NODATA,errmsg='无城区信息')
-    # 定义容器,存储查询结果
-    areas_list = []
-    # 遍历查询结果
-    for area in areas:
-        areas_list.append(area.to_dict())
-    # 序列化城区数据
-    areas_json = json.dumps(areas_list)
-    # 把城区信息写入redis缓存中
+        return etag_response('{"errno":0,"errmsg":"OK","data":%s}' %areas,etag)
+    # 缓存中没有数据,只允许一个请求查询mysql重建缓存,其它请求等待重建的结果
+    with single_flight('area_info'):
+        # 重新读取缓存,其它请求可能已经完成了重建
+        try:
+            areas = codec.decode(redis_binary_store.get('area_info'))
+        except Exception as e:
+            current_app.logger.error(e)
+            areas = None
+        if areas:
+            return etag_response('{"errno":0,"errmsg":"OK","data":%s}' %areas,make_etag(areas))
+        # 如果缓存中没有数据,需要读取mysql数据库
+        try:
+            areas = Area.query.all()
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.DBERR,errmsg='查询城区信息异常')
+        # 判断查询结果
+        if not areas:
+            return jsonify(errno=RET.NODATA,errmsg='无城区信息')
+        # 定义容器,存储查询结果
+        areas_list = []
+        # 遍历查询结果
+        for area in areas:
+            areas_list.append(area.to_dict())
+        # 序列化城区数据,并计算ETag
+        areas_json = json.dumps(areas_list)
+        etag = make_etag(areas_json)
+        # 把城区信息和ETag写入redis缓存中
+        try:
+            pip = redis_store.pipeline()
+            pip.setex('area_info',constants.AREA_INFO_REDIS_EXPIRES,codec.encode(areas_json))
+            pip.setex(etag_key('area_info'),constants.AREA_INFO_REDIS_EXPIRES,etag)
+            pip.execute()
+        except Exception as e:
+            current_app.logger.error(e)
+        local_cache.set('area_info',(areas_json,etag))
+    # 返回数据
+    resp = '{"errno":0,"errmsg":"OK","data":%s}' % areas_json
+    return etag_response(resp,etag)
+
+def get_facility_ids():
+    """
+    获取全部设施编号:一级缓存----redis缓存----磁盘
+    设施信息几乎不变,发布房源时用来校验设施参数,不需要每次查询mysql
+    """
+    facility_ids = local_cache.get('facility_info')
+    if facility_ids is not None:
+        return facility_ids
     try:
-        redis_store.setex('area_info',constants.AREA_INFO_REDIS_EXPIRES,areas_json)
+        ret = codec.decode(redis_binary_store.get('facility_info'))
     except Exception as e:
         current_app.logger.error(e)
-    # 返回数据
-    resp = '{"errno":0,"errmsg":"OK","data":%s}' % areas_json
-    return resp
+        ret = None
+    if ret:
+        facility_ids = set(json.loads(ret))
+    else:
+        facility_ids = set(facility_id for facility_id, in db.session.query(Facility.id))
+        try:
+            redis_store.setex('facility_info',constants.FACILITY_INFO_REDIS_EXPIRES,
+                              codec.encode(json.dumps(sorted(facility_ids))))
+        except Exception as e:
+            current_app.logger.error(e)
+    local_cache.set('facility_info',facility_ids)
+    return facility_ids
+
 
 @api.route('/houses',methods=['POST'])
 @login_required
@@ -141,23 +232,46 @@ def save_house_info():
     # 尝试获取房屋配套设施
     facility = house_data.get('facility')
     # 判断配套设施是否存在
+    facility_ids = []
     if facility:
-        # 对配套设施进行检查,确认配套设施在数据库中存在
+        # 对设施编号进行格式转换,设施编号必须是整数
         try:
-            facilities = Facility.query.filter(Facility.id.in_(facility)).all()
-            # 存储房屋配套设施
-            house.facilities = facilities
+            requested_ids = set(int(facility_id) for facility_id in facility)
+        except (TypeError,ValueError) as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.PARAMERR,errmsg='配套设施参数错误')
+        # 设施编号对应位掩码中的位,超出掩码范围的设施无法保存
+        if not all(0 < facility_id <= constants.HOUSE_FACILITY_MAX_ID for facility_id in requested_ids):
+            return jsonify(errno=RET.PARAMERR,errmsg='配套设施编号超出范围')
+        # 对配套设施进行检查,确认配套设施存在,设施信息从缓存中获取
+        try:
+            all_facility_ids = get_facility_ids()
         except Exception as e:
             current_app.logger.error(e)
             return jsonify(errno=RET.DBERR,errmsg='查询配套设施异常')
+        facility_ids = sorted(requested_ids & all_facility_ids)
+        # 保存设施位掩码,用于房屋列表按设施过滤
+        house.facility_mask = House.facility_mask_of(facility_ids)
     # 存储房屋数据
     try:
         db.session.add(house)
+        # 生成房屋id后,直接写入房屋与设施的关联表
+        if facility_ids:
+            db.session.flush()
+            db.session.execute(house_facility.insert(),
+                               [{'house_id':house.id,'facility_id':facility_id} for facility_id in facility_ids])
         db.session.commit()
     except Exception as e:
         current_app.logger.error(e)
         db.session.rollback()
         return jsonify(errno=RET.DBERR,errmsg='保存房屋信息失败')
+    # 新房源发布后,写入房屋排序索引和关键字搜索索引,并使所属城区的房屋列表缓存失效
+    try:
+        house_index.add_house(house)
+        search.index_house(house)
+        invalidate_houses_list(house.area_id)
+    except Exception as e:
+        current_app.logger.error(e)
     # 返回结果,返回的house_id是给后面上传房屋图片,和房屋进行关联
     return jsonify(errno=RET.OK,errmsg='OK',data={'house_id':house.id})
 
@@ -223,6 +337,11 @@ def save_house_image(house_id):
         current_app.logger.error(e)
         db.session.rollback()
         return jsonify(errno=RET.DBERR,errmsg='保存图片失败')
+    # 房屋主图片可能发生变化,删除房屋摘要缓存,列表页中的房屋id不受影响
+    try:
+        house_summary.invalidate(house.id)
+    except Exception as e:
+        current_app.logger.error(e)
     # 拼接图片的url
     image_url = constants.QINIU_DOMIN_PREFIX + image_name
     # 返回结果
@@ -235,9 +354,8 @@ def get_user_houses():
     """
     获取用户发布的房屋信息
     1/获取用户id
-    2/查询数据库,user_id
-    user = User.query.get(user_id)
-    houses = user.houses
+    2/查询数据库,user_id,同时加载房屋的城区和房东
+    houses = house_basic_query().filter(House.user_id == user_id).all()
     3/定义容器
     4/判断获取结果,如果有数据,存储到列表中,遍历
     5/返回结果
@@ -245,11 +363,9 @@ def get_user_houses():
     """
     # 获取用户身份
     user_id = g.user_id
-    # 查询User表,确定用户的存在,其次使用关系引用,获取用户关联的房屋
+    # 查询用户发布的房屋,同时加载房屋的城区和房东,避免逐条懒加载
     try:
-        user = User.query.get(user_id)
-        # 使用反向引用
-        houses = user.houses
+        houses = house_basic_query().filter(House.user_id == user_id).all()
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR,errmsg='查询用户房屋数据失败')
@@ -263,13 +379,54 @@ def get_user_houses():
     return jsonify(errno=RET.OK,errmsg='OK',data={'houses':houses_list})
 
 
+def build_home_page_data():
+    """查询mysql生成首页房屋数据,写入缓存,返回json字符串"""
+    # 排序索引已构建时,从按成交次数排序的有序集合中取出排名最前的房屋id,有序集合的分值包含尚未写入数据库的增量
+    # 数据库中的order_count由flush_order_count定时写入,直接按该字段排序会选出过时的房屋
+    try:
+        house_ids = house_index.range_ids(None,'booking',0,constants.HOME_PAGE_MAX_HOUSES - 1) \
+            if house_index.is_ready() else None
+    except Exception as e:
+        current_app.logger.error(e)
+        house_ids = None
+    if house_ids is not None:
+        houses_by_id = dict((house.id,house) for house in house_basic_query().filter(House.id.in_(house_ids)))
+        houses = [houses_by_id[house_id] for house_id in house_ids if house_id in houses_by_id]
+    else:
+        # 查询磁盘数据库,采取默认操作,按房屋成交次数进行排序
+        houses = house_basic_query().order_by(House.order_count.desc()).limit(constants.HOME_PAGE_MAX_HOUSES).all()
+    # 完成订单数尚未写入数据库的增量
+    deltas = order_counter.pending([house.id for house in houses])
+    # 定义容器,存储查询结果
+    houses_list = []
+    # 遍历查询结果,过滤没有房屋主图片的房屋
+    for house in houses:
+        if not house.index_image_url:
+            continue
+        house_dict = house.to_basic_dict()
+        house_dict['order_count'] = (house.order_count or 0) + deltas.get(house.id,0)
+        houses_list.append(house_dict)
+    # 按当前的完成订单数重新排序
+    houses_list.sort(key=lambda house_dict:house_dict['order_count'],reverse=True)
+    # 序列化房屋数据
+    houses_json = json.dumps(houses_list)
+    # 写入到redis缓存中,同时保存完整响应的压缩版本
+    try:
+        set_with_freshness('home_page_data',houses_json,constants.HOME_PAGE_DATA_SOFT_EXPIRES,
+                           constants.HOME_PAGE_DATA_REDIS_EXPIRES,
+                           body='{"errno":0,"errmsg":"OK","data":%s}' % houses_json)
+    except Exception as e:
+        current_app.logger.error(e)
+    return houses_json
+
+
 @api.route('/houses/index',methods=['GET'])
 def get_houses_index():
     """
     获取首页幻灯片信息:缓存----磁盘----缓存
     1/尝试从redis缓存中读取房屋数据
     2/如果有数据,留下访问redis数据的记录
-    3/redis中存储的数据是json字符串,可以直接返回
+    3/redis中存储的数据是json字符串,可以直接返回;如果已超过新鲜期,同时在后台重建缓存
     4/查询mysql数据库,对幻灯片的处理,默认采取房屋的成交次数,最多展示五条
     5/判断获取结果
     6/定义容器,遍历获取结果,判断房屋是否设置图片,如未设置默认不添加
@@ -280,40 +437,144 @@ def get_houses_index():
     """
     # 尝试从缓存中获取房屋数据
     try:
-        ret = redis_store.get('home_page_data')
+        # 客户端带有If-None-Match时,先只读取ETag进行比较,一致时直接返回304
+        if request.if_none_match:
+            etag = redis_store.get(etag_key('home_page_data'))
+            if is_not_modified(etag):
+                return not_modified(etag)
+        # 客户端可接受压缩时,直接返回缓存中的压缩版本
+        encoding,data,etag,stale = get_compressed('home_page_data')
+        if encoding:
+            if stale:
+                refresh_in_background('home_page_data',build_home_page_data)
+            return compressed_response(data,encoding,etag)
+        ret,stale,etag = get_with_freshness('home_page_data')
     except Exception as e:
         current_app.logger.error(e)
-        ret = None
+        ret,stale,etag = None,False,None
     # 判断获取结果,如果有数据,留下记录,直接返回
     if ret:
         current_app.logger.info('hit redis house index info')
-        return '{"errno":0,"errmsg":"OK","data":%s}' % ret
-    # 查询磁盘数据库,采取默认操作,按房屋成交次数进行排序
+        # 超过新鲜期,先返回旧数据,在后台重建缓存
+        if stale:
+            try:
+                refresh_in_background('home_page_data',build_home_page_data)
+            except Exception as e:
+                current_app.logger.error(e)
+        return etag_response('{"errno":0,"errmsg":"OK","data":%s}' % ret,etag or make_etag(ret))
+    # 缓存中没有数据,只允许一个请求查询mysql重建缓存,其它请求等待重建的结果
+    with single_flight('home_page_data'):
+        # 重新读取缓存,其它请求可能已经完成了重建
+        try:
+            ret = codec.decode(redis_binary_store.get('home_page_data'))
+        except Exception as e:
+            current_app.logger.error(e)
+            ret = None
+        if ret:
+            return etag_response('{"errno":0,"errmsg":"OK","data":%s}' % ret,make_etag(ret))
+        # 查询磁盘数据库,生成首页房屋数据
+        try:
+            houses_json = build_home_page_data()
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.DBERR,errmsg='查询房屋数据异常')
+    # 构造响应数据,返回结果
+    resp = '{"errno":0,"errmsg":"OK","data":%s}' % houses_json
+    return etag_response(resp,make_etag(houses_json))
+
+
+def build_house_details(house_ids):
+    """
+    查询mysql生成多个房屋的详情数据,写入缓存,返回{房屋id:包含评论的json字符串},不存在的房屋不在结果中
+    查询次数与房屋数量无关:房屋和房东/图片/设施/评论各一条sql
+    房屋详情缓存中不包含评论,评论写入各房屋的评论列表
+    """
+    # 查询磁盘数据库,同时加载房东/图片/设施
+    houses = house_full_query().filter(House.id.in_(house_ids)).all()
+    # 批量查询房屋的评论,查询前读取评论列表的版本号,查询期间有新的评价时不写入评论列表
     try:
-        houses = House.query.order_by(House.order_count.desc()).limit(constants.HOME_PAGE_MAX_HOUSES)
+        comment_versions = comments.versions([house.id for house in houses])
     except Exception as e:
         current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR,errmsg='查询房屋数据异常')
-    # 判断获取结果
-    if not houses:
-        return jsonify(errno=RET.NODATA,errmsg='无房屋数据')
-    # 定义容器,存储查询结果
-    houses_list = []
-    # 遍历查询结果,过滤没有房屋主图片的房屋
+        comment_versions = None
+    orders = house_comments([house.id for house in houses]) if houses else {}
+    houses_json = {}
     for house in houses:
-        if not house.index_image_url:
-            continue
-        houses_list.append(house.to_basic_dict())
-    # 序列化房屋数据
-    houses_json = json.dumps(houses_list)
-    # 写入到redis缓存中
+        # 获取房屋详情数据,把评论和房屋本身的数据分别序列化
+        house_dict = house.to_full_dict(orders[house.id])
+        comment_jsons = [json.dumps(comment) for comment in house_dict.pop('comments')]
+        house_json = json.dumps(house_dict)
+        houses_json[house.id] = comments.with_comments(house_json,comment_jsons)
+        # 把房屋详情数据和评论存入redis缓存中
+        try:
+            set_with_freshness('house_info_%s' % house.id,house_json,constants.HOUSE_DETAIL_SOFT_EXPIRE_SECOND,
+                               constants.HOUSE_DETAIL_REDIS_EXPIRE_SECOND)
+            if comment_versions is not None:
+                comments.load(house.id,comment_jsons,comment_versions[house.id])
+        except Exception as e:
+            current_app.logger.error(e)
+    return houses_json
+
+
+def build_house_detail(house_id):
+    """查询mysql生成房屋详情数据,写入缓存,返回json字符串,房屋不存在时返回None"""
+    return build_house_details([house_id]).get(house_id)
+
+
+@api.route('/houses/batch',methods=['GET'])
+def get_houses_batch():
+    """
+    批量获取房屋详情信息,用于收藏/对比等需要同时展示多个房屋的页面
+    1/获取参数ids,多个房屋id用逗号分隔,去重后数量不能超过HOUSE_BATCH_MAX_COUNT
+    2/一次MGET读取全部房屋的详情缓存,批量读取这些房屋的评论列表拼接到详情数据中
+    3/缓存中没有的房屋,使用固定次数的sql批量查询,并写入缓存
+    4/按请求的顺序构造响应数据,不存在的房屋不返回
+    :return:
+    """
+    # 获取用户身份id
+    user_id = session.get('user_id','-1')
+    # 获取参数,对房屋id进行处理,保持请求的顺序并去重
     try:
-        redis_store.setex('home_page_data',constants.HOME_PAGE_DATA_REDIS_EXPIRES,houses_json)
+        house_ids = []
+        for house_id in request.args.get('ids','').split(','):
+            if house_id and int(house_id) not in house_ids:
+                house_ids.append(int(house_id))
+        assert 0 < len(house_ids) <= constants.HOUSE_BATCH_MAX_COUNT
     except Exception as e:
         current_app.logger.error(e)
-    # 构造响应数据,返回结果
-    resp = '{"errno":0,"errmsg":"OK","data":%s}' % houses_json
-    return resp
+        return jsonify(errno=RET.PARAMERR,errmsg='房屋id参数错误')
+    # 一次读取全部房屋的详情缓存
+    try:
+        values = redis_binary_store.mget(['house_info_%s' % house_id for house_id in house_ids])
+    except Exception as e:
+        current_app.logger.error(e)
+        values = [None] * len(house_ids)
+    houses_json = dict((house_id,codec.decode(value)) for house_id,value in zip(house_ids,values))
+    cached_ids = [house_id for house_id in house_ids if houses_json[house_id] is not None]
+    missing_ids = [house_id for house_id in house_ids if houses_json[house_id] is None]
+    try:
+        # 缓存中有数据的房屋,批量读取评论列表并拼接
+        if cached_ids:
+            houses_comments = comments.get_comments(cached_ids)
+            for house_id in cached_ids:
+                houses_json[house_id] = comments.with_comments(houses_json[house_id],houses_comments[house_id])
+        # 缓存中没有的房屋,批量查询磁盘数据库
+        if missing_ids:
+            houses_json.update(build_house_details(missing_ids))
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR,errmsg='查询房屋详情数据异常')
+    # 构造响应数据,按请求的顺序排列
+    houses = ','.join(houses_json[house_id] for house_id in house_ids if houses_json[house_id] is not None)
+    resp = '{"errno":0,"errmsg":"OK","data":{"user_id":%s,"houses":[%s]}}' % (user_id,houses)
+    return etag_response(resp,make_etag(resp))
+
+
+def house_detail_etag(etag,version,user_id):
+    """房屋详情响应的ETag:房屋详情缓存的ETag.评论列表的版本号-用户身份id,没有房屋详情缓存的ETag时返回None"""
+    if not etag:
+        return None
+    return '%s.%s-%s' % (etag,version or 0,user_id)
 
 
 @api.route('/houses/<int:house_id>',methods=['GET'])
@@ -324,13 +585,13 @@ def get_house_detail(house_id):
     user_id = session.get('user_id','-1')
     2/校验house_id参数的存在
     3/尝试从redis缓存中读取房屋详情数据
-    4/校验结果
+    4/校验结果,如果已超过新鲜期,先返回旧数据,同时在后台重建缓存
     5/查询磁盘数据库
     house = House.query.get(house_id)
     6/校验查询结果,确认房屋的存在
     7/调用模型类中的hosue.to_full_dict()
     8/序列化数据
-    9/存入redis缓存中
+    9/存入redis缓存中,评论单独存入评论列表,读取时拼接到房屋数据中
     10/构造响应数据,返回结果
     return '{"errno":0,"errmsg":"OK","data":{"user_id":%s,"house":%s}}' % (user_id,house_json)
     :return:
@@ -340,42 +601,182 @@ def get_house_detail(house_id):
     # 确定house_id参数的存在
     if not house_id:
         return jsonify(errno=RET.PARAMERR,errmsg='参数错误')
-    # 尝试从redis缓存中获取房屋数据
+    # 记录访问次数,用来预热缓存
     try:
-        ret = redis_store.get('house_info_%s' % house_id)
+        record_hit()
     except Exception as e:
         current_app.logger.error(e)
-        ret = None
-    # 判断获取结果,留下记录,直接返回
+    # 响应中包含用户身份id和评论,ETag由房屋详情缓存的ETag、评论列表的版本号和用户身份id组成,
+    # 房屋数据或评论变化时ETag随之变化;客户端带有If-None-Match时,先只读取这几个值进行比较,一致时直接返回304
+    key = 'house_info_%s' % house_id
+    if request.if_none_match:
+        try:
+            etag,fresh,version = redis_store.mget(etag_key(key),'fresh_%s' % key,comments.version_key(house_id))
+            if etag and is_not_modified(house_detail_etag(etag,version,user_id)):
+                # 超过新鲜期时仍然在后台重建缓存
+                if fresh is None:
+                    refresh_in_background(key,build_house_detail,house_id)
+                return not_modified(house_detail_etag(etag,version,user_id))
+        except Exception as e:
+            current_app.logger.error(e)
+    # 尝试从redis缓存中获取房屋数据,评论列表的版本号在读取评论之前读取
+    try:
+        version = comments.versions([house_id])[house_id]
+        ret,stale,etag = get_with_freshness(key)
+    except Exception as e:
+        current_app.logger.error(e)
+        version,ret,stale,etag = None,None,False,None
+    # 判断获取结果,留下记录,拼接评论后返回
     if ret:
         current_app.logger.info('hit redis house detail info')
-        return '{"errno":0,"errmsg":"OK","data":{"user_id":%s,"house":%s}}' % (user_id,ret)
-    # 需要查询磁盘数据库
+        # 超过新鲜期,先返回旧数据,在后台重建缓存
+        if stale:
+            try:
+                refresh_in_background(key,build_house_detail,house_id)
+            except Exception as e:
+                current_app.logger.error(e)
+        try:
+            house_json = comments.with_comments(ret,comments.get_comments([house_id])[house_id])
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.DBERR,errmsg='查询房屋详情数据异常')
+        resp = '{"errno":0,"errmsg":"OK","data":{"user_id":%s,"house":%s}}' % (user_id,house_json)
+        return etag_response(resp,house_detail_etag(etag,version,user_id))
+    # 缓存中没有数据,只允许一个请求查询mysql重建缓存,其它请求等待重建的结果
+    with single_flight(key):
+        # 重新读取缓存,其它请求可能已经完成了重建
+        try:
+            ret,stale,etag = get_with_freshness(key)
+        except Exception as e:
+            current_app.logger.error(e)
+            ret,etag = None,None
+        if ret:
+            try:
+                house_json = comments.with_comments(ret,comments.get_comments([house_id])[house_id])
+            except Exception as e:
+                current_app.logger.error(e)
+                return jsonify(errno=RET.DBERR,errmsg='查询房屋详情数据异常')
+            resp = '{"errno":0,"errmsg":"OK","data":{"user_id":%s,"house":%s}}' % (user_id,house_json)
+            return etag_response(resp,house_detail_etag(etag,version,user_id))
+        # 查询磁盘数据库,生成房屋详情数据
+        try:
+            house_json = build_house_detail(house_id)
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.DBERR,errmsg='查询房屋详情数据异常')
+        # 检查查询结果
+        if house_json is None:
+            return jsonify(errno=RET.NODATA,errmsg='房屋不存在')
+        # 读取重建时写入的ETag
+        try:
+            etag = redis_store.get(etag_key(key))
+        except Exception as e:
+            current_app.logger.error(e)
+            etag = None
+    # 构造响应数据
+    resp = '{"errno":0,"errmsg":"OK","data":{"user_id":%s,"house":%s}}' % (user_id,house_json)
+    return etag_response(resp,house_detail_etag(etag,version,user_id))
+
+
+@api.route('/houses/<int:house_id>/calendar',methods=['GET'])
+def get_house_calendar(house_id):
+    """
+    获取房屋的预订日历:从今天开始months个月内已被预订的日期
+    1/获取参数months,默认3个月,最多HOUSE_CALENDAR_MAX_MONTHS个月,确认房屋存在
+    2/从房屋可预订状态位图中一次读取日期范围内的位,下单/拒单时位图已经增量更新,不需要查询订单表
+    3/位图索引未构建时,查询该房屋在日期范围内的有效订单
+    4/把连续的已预订日期合并为[开始日期,结束日期],返回结果
+    :return:
+    """
+    # 获取参数,对月数进行处理
     try:
-        house = House.query.get(house_id)
+        months = int(request.args.get('months',constants.HOUSE_CALENDAR_DEFAULT_MONTHS))
+        assert 0 < months <= constants.HOUSE_CALENDAR_MAX_MONTHS
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.PARAMERR,errmsg='月数参数错误')
+    # 确认房屋存在,不存在的房屋没有订单,位图和订单表都会返回空的日历
+    try:
+        house = db.session.query(House.id).filter_by(id=house_id).first()
     except Exception as e:
         current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR,errmsg='查询房屋数据异常')
-    # 检查查询结果
+        return jsonify(errno=RET.DBERR,errmsg='查询房屋信息异常')
     if not house:
         return jsonify(errno=RET.NODATA,errmsg='房屋不存在')
-    # 获取房屋详情数据
+    # 日期范围,从今天开始到months个月后的前一天
+    start_date = datetime.date.today()
+    year,month = divmod(start_date.month - 1 + months,12)
+    month_days = calendar.monthrange(start_date.year + year,month + 1)[1]
+    end_date = start_date.replace(year=start_date.year + year,month=month + 1,day=min(start_date.day,month_days))
+    end_date -= datetime.timedelta(days=1)
+    # 查询已被预订的日期范围
     try:
-        # 因为to_full_dict方法里面实现房屋详情数据,需要查询数据库,所以进行异常处理
-        house_data = house.to_full_dict()
+        if availability.is_ready():
+            booked = availability.booked_ranges(house_id,start_date,end_date)
+        else:
+            booked = availability.booked_ranges_from_orders(house_id,start_date,end_date)
     except Exception as e:
         current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR,errmsg='查询房屋详情数据异常')
-    # 序列化房屋详情数据
-    house_json = json.dumps(house_data)
-    # 把房屋详情数据存入redis缓存中
+        return jsonify(errno=RET.DBERR,errmsg='查询房屋预订日历异常')
+    # 构造响应数据
+    resp = json.dumps({'errno':RET.OK,'errmsg':'OK','data':{
+        'start_date':start_date.strftime('%Y-%m-%d'),
+        'end_date':end_date.strftime('%Y-%m-%d'),
+        'booked':[[begin.strftime('%Y-%m-%d'),end.strftime('%Y-%m-%d')] for begin,end in booked],
+    }})
+    return etag_response(resp,make_etag(resp))
+
+
+def render_houses_page(page_data,page):
+    """
+    根据缓存的房屋id列表构造房屋列表页的响应报文
+    page_data为{'ids':当前页的房屋id,'total_page':总页数},游标分页时为{'ids':...,'next_cursor':下一页的游标}
+    """
+    houses_json = ','.join(house_summary.get_summaries(page_data['ids']))
+    if 'next_cursor' in page_data:
+        return '{"errno":0,"errmsg":"OK","data":{"houses":[%s],"next_cursor":%s}}' % (
+            houses_json,json.dumps(page_data['next_cursor']))
+    return '{"errno":0,"errmsg":"OK","data":{"houses":[%s],"total_page":%s,"current_page":%s}}' % (
+        houses_json,page_data['total_page'],page)
+
+
+def houses_page_validator(page_data):
+    """列表页的验证值:页面数据的摘要:当前页的房屋id,与页面数据一起写入缓存,验证ETag时不需要读取页面数据"""
+    return '%s:%s' % (make_etag(json.dumps(page_data,sort_keys=True)),','.join(str(house_id) for house_id in page_data['ids']))
+
+
+def houses_page_etag(validator):
+    """列表页的ETag,由列表页的验证值和当前页各房屋摘要的版本号计算,房屋摘要变化时ETag随之变化"""
+    house_ids = [int(house_id) for house_id in validator.split(':')[1].split(',') if house_id]
+    return make_etag('%s:%s' % (validator,','.join(house_summary.versions(house_ids))))
+
+
+def available_houses_ids(redis_key,area_id,sort_key,start_date,end_date):
+    """
+    城区内排好序并且在日期范围内可预订的全部房屋id,用于按日期过滤的列表页分页
+    过滤结果保存在列表页缓存的available_ids字段中,同一个城区、日期和排序条件的各页共享,
+    下单、拒单、取消订单时列表页缓存的版本号变化,过滤结果随之失效
+    """
     try:
-        redis_store.setex('house_info_%s' % house_id,constants.HOUSE_DETAIL_REDIS_EXPIRE_SECOND,house_json)
+        ret = codec.decode(redis_binary_store.hget(redis_key,'available_ids')) if redis_key else None
     except Exception as e:
         current_app.logger.error(e)
-    # 构造响应数据
-    resp = '{"errno":0,"errmsg":"OK","data":{"user_id":%s,"house":%s}}' % (user_id,house_json)
-    return resp
+        ret = None
+    if ret:
+        return json.loads(ret)
+    # 取出城区内排好序的全部房屋id,过滤掉已被预订的房屋
+    houses_ids = house_index.range_ids(area_id,sort_key)
+    booked_houses_id = set(availability.filter_booked(houses_ids,start_date,end_date))
+    houses_ids = [house_id for house_id in houses_ids if house_id not in booked_houses_id]
+    if redis_key:
+        pip = redis_store.pipeline()
+        try:
+            pip.hset(redis_key,'available_ids',codec.encode(json.dumps(houses_ids)))
+            pip.expire(redis_key,constants.HOUSE_LIST_REDIS_EXPIRES)
+            pip.execute()
+        except Exception as e:
+            current_app.logger.error(e)
+    return houses_ids
 
 
 @api.route('/houses',methods=['GET'])
@@ -398,7 +799,8 @@ def get_houses_list():
     7/查询磁盘数据库
     8/首先定义容器(存储查询语句的过滤条件,用来筛选出符合条件的房屋),存储查询的过滤条件,params_filter = []
     9/判断区域参数是否存在,如果存在添加到过滤条件中
-    10/判断日期参数是否存在,比较用户选择的日期和数据库中订单的日期进行比较,得到满足条件的房屋
+    10/判断日期参数是否存在,比较用户选择的日期和数据库中订单的日期进行比较,得到满足条件的房屋,
+    使用NOT EXISTS子查询在数据库中排除有冲突订单的房屋,不需要把冲突订单读取出来
     11/过滤条件的容器里已经存储了区域信息,和满足条件的房屋
     12/判断排序条件,根据排序条件执行查询数据库操作,booking/price-inc/price-des/order_count.desc()
     houses = House.query.filter(*params_filter).order_by(House.price.desc())
@@ -416,6 +818,9 @@ def get_houses_list():
     18/构造redis_key,存储房屋列表页的缓存数据,因为使用的是hash数据类型,为了确保数据的完整性,需要使用事务;开启事务,存储数据,设置有效期,执行事务/
     pip = redis_store.pipeline()
     19/返回结果resp_json
+    20/如果传递了cursor参数,使用键集分页代替页数分页:按(排序值,房屋id)定位上一页的最后一条记录,
+    只查询下一页的数据,不再执行count和offset,返回next_cursor用于请求下一页,首页传递空的cursor
+    21/缓存中只保存当前页的房屋id列表,房屋数据从房屋摘要缓存中一次MGET读取,缺失的摘要使用一条sql批量查询
 
     :return:
     """
@@ -426,6 +831,11 @@ def get_houses_list():
     end_date_str = request.args.get('ed','')
     sort_key = request.args.get('sk','new') # 排序条件new为默认排序,房屋发布时间
     page = request.args.get('p','1') # 默认第一页
+    cursor = request.args.get('cursor') # 键集分页游标,传递该参数时使用游标分页
+    facility_str = request.args.get('fac','') # 房屋设施,多个设施编号用逗号分隔,要求房屋同时具备
+    keyword = request.args.get('q','').strip() # 搜索关键字,匹配房屋的标题和地址
+    # 排序字段,未知的排序条件按默认排序处理
+    sort_column,sort_desc = HOUSE_LIST_SORTS.get(sort_key,HOUSE_LIST_SORTS['new'])
     # 参数处理,对日期进行处理
     try:
         # 保存格式化后的日期
@@ -448,104 +858,188 @@ def get_houses_list():
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.PARAMERR,errmsg='页数格式化错误')
-    # 尝试从redis缓存中获取房屋的列表数据,因为多条数据的存储,使用的hash数据类型,首先需要键值
+    # 对设施参数进行处理,去重排序后作为缓存键的一部分,并转换为位掩码
     try:
-        # redis_key相当于hash的对象,里面存储的是页数和对应房屋数据
-        redis_key = 'houses_%s_%s_%s_%s' %(area_id,start_date_str,end_date_str,sort_key)
-        # 根据redis_key获取缓存数据
-        ret = redis_store.hget(redis_key,page)
+        facility_ids = sorted(set(int(facility_id) for facility_id in facility_str.split(',') if facility_id))
+        assert all(0 < facility_id <= constants.HOUSE_FACILITY_MAX_ID for facility_id in facility_ids)
+        facility_str = ','.join(str(facility_id) for facility_id in facility_ids)
+        facility_mask = House.facility_mask_of(facility_ids)
     except Exception as e:
         current_app.logger.error(e)
-        ret = None
-    # 判断获取结果,如果有数据,留下记录,直接返回
-    if ret:
-        current_app.logger.info('hit redis houses list info')
-        # return {"errno":0,"errmsg":"OK"***}
-        # ret里面已经是完整的响应报文,所以可以直接返回
-        return ret
-    # 查询磁盘数据库,目的:过滤条件---->查询数据--->排序---->分页,得到满足条件的房屋
+        return jsonify(errno=RET.PARAMERR,errmsg='设施参数错误')
+    # 对游标进行解码,得到上一页最后一条记录的排序值和房屋id
+    last_value,last_id = None,None
+    if cursor:
+        try:
+            last_value,last_id = decode_cursor(cursor)
+            if sort_column is House.create_time:
+                last_value = datetime.datetime.strptime(last_value,CURSOR_TIME_FORMAT)
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.PARAMERR,errmsg='游标格式错误')
+    # 参数有效,记录访问次数,用来预热缓存
     try:
-        # 定义容器,存储过滤条件,主要是区域信息/日期参数
-        params_filter = []
-        # 判断区域信息的存在
-        if area_id:
-            """
-            a = [1,2,3]
-            b = 1
-            a.append(a==b)
-            a=[1,2,3,false]
-            """
-            # 列表中添加的是sqlalchemy对象<>
-            params_filter.append(House.area_id == area_id)
-        # 对日期参数的进行查询,如果用户选择了开始日期和结束日期
-        if start_date and end_date:
-            # 存储有冲突订单
-            conflict_orders = Order.query.filter(Order.begin_date<=end_date,Order.end_date>=start_date).all()
-            # 遍历有冲突的订单,获取有冲突的房屋
-            conflict_houses_id = [order.house_id for order in conflict_orders]
-            # 判断有冲突的房屋存在,对有冲突的房屋取反,添加不冲突的房屋
-            if conflict_houses_id:
-                params_filter.append(House.id.notin_(conflict_houses_id))
-        # 如果用户只选择了开始日期
-        elif start_date:
-            conflict_orders = Order.query.filter(Order.end_date>=start_date).all()
-            conflict_houses_id = [order.house_id for order in conflict_orders]
-            if conflict_houses_id:
-                params_filter.append(House.id.notin_(conflict_houses_id))
-        # 如果用户只选择了结束日期
-        elif end_date:
-            conflict_orders = Order.query.filter(Order.begin_date<=end_date).all()
-            conflict_houses_id = [order.house_id for order in conflict_orders]
-            if conflict_houses_id:
-                params_filter.append(House.id.notin_(conflict_houses_id))
-        # 过滤条件实现后,执行查询排序操作,booking/price-inc/price-des/new
-        # 按成交次数排序
-        if 'booking' == sort_key:
-            houses = House.query.filter(*params_filter).order_by(House.order_count.desc())
-        # 按价格升序排序
-        elif 'price-inc' == sort_key:
-            houses = House.query.filter(*params_filter).order_by(House.price.asc())
-        # 按价格降序排序
-        elif 'price-des' == sort_key:
-            houses = House.query.filter(*params_filter).order_by(House.price.desc())
-        # 默认排序,按照房屋的发布时间进行排序
-        else:
-            houses = House.query.filter(*params_filter).order_by(House.create_time.desc())
-        # 对排序结果进行分页操作,page页数/每页条目数/False表示分页异常不报错
-        houses_page = houses.paginate(page,constants.HOUSE_LIST_PAGE_CAPACITY,False)
-        # 获取分页后的房屋数据和总页数
-        houses_list = houses_page.items
-        total_page = houses_page.pages
-        # 定义容器,遍历分页后的房屋数据,调用模型类中的方法,获取房屋的基本信息
-        houses_dict_list = []
-        for house in houses_list:
-            houses_dict_list.append(house.to_basic_dict())
+        record_hit()
     except Exception as e:
         current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR,errmsg='查询房屋列表信息异常')
-    # 构造响应报文
-    resp = {"errno":0,"errmsg":"OK","data":{"houses":houses_dict_list,"total_page":total_page,"current_page":page}}
-    # 序列化数据
-    resp_json = json.dumps(resp)
-    # 存储序列化后的房屋列表数据
-    # 判断用户请求的页数小于分页后的总页数,即用户请求的页数有数据
-    if page <= total_page:
-        redis_key = 'houses_%s_%s_%s_%s' %(area_id,start_date_str,end_date_str,sort_key)
-        # 可以使用事务,对多条数据同时操作
-        pip = redis_store.pipeline()
+    # 缓存中的字段,页数分页使用页数,游标分页使用游标
+    cache_field = page if cursor is None else 'cursor_%s' % cursor
+    # 尝试从redis缓存中获取当前页的房屋id列表,因为多条数据的存储,使用的hash数据类型,首先需要键值
+    try:
+        # redis_key相当于hash的对象,里面存储的是页数和对应的房屋id列表,以及页面的验证值,键中包含缓存版本号
+        redis_key = houses_list_key(area_id,start_date_str,end_date_str,sort_key,facility_str,keyword)
+        # 客户端带有If-None-Match时,先只读取页面的验证值和房屋摘要的版本号计算ETag,一致时直接返回304
+        if request.if_none_match:
+            validator = redis_store.hget(redis_key,'validator_%s' % cache_field)
+            if validator and is_not_modified(houses_page_etag(validator)):
+                return not_modified(houses_page_etag(validator))
+        ret = codec.decode(redis_binary_store.hget(redis_key,cache_field))
+    except Exception as e:
+        current_app.logger.error(e)
+        redis_key,ret = None,None
+    # 判断获取结果,如果有数据,留下记录,批量读取房屋摘要后返回
+    if ret:
+        current_app.logger.info('hit redis houses list info')
         try:
-            # 开启事务
-            pip.multi()
-            # 存储数据
-            pip.hset(redis_key,page,resp_json)
-            # 设置过期时间
-            pip.expire(redis_key,constants.HOUSE_LIST_REDIS_EXPIRES)
-            # 执行事务
-            pip.execute()
+            page_data = json.loads(ret)
+            # 在读取房屋摘要之前计算ETag
+            etag = houses_page_etag(houses_page_validator(page_data))
+            resp_json = render_houses_page(page_data,page)
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.DBERR,errmsg='查询房屋列表信息异常')
+        return etag_response(resp_json,etag)
+    # 缓存中没有数据,只允许一个请求查询mysql重建当前页的缓存,其它请求等待重建的结果
+    with single_flight('%s_%s' % (redis_key,cache_field)):
+        # 重新读取缓存,其它请求可能已经完成了重建
+        try:
+            ret = codec.decode(redis_binary_store.hget(redis_key,cache_field)) if redis_key else None
         except Exception as e:
             current_app.logger.error(e)
-    # 返回响应数据
-    return resp_json
+            ret = None
+        if ret:
+            try:
+                page_data = json.loads(ret)
+                etag = houses_page_etag(houses_page_validator(page_data))
+                resp_json = render_houses_page(page_data,page)
+            except Exception as e:
+                current_app.logger.error(e)
+                return jsonify(errno=RET.DBERR,errmsg='查询房屋列表信息异常')
+            return etag_response(resp_json,etag)
+        # 查询磁盘数据库,目的:过滤条件---->查询数据--->排序---->分页,得到满足条件的房屋
+        try:
+            # 是否使用可预订状态位图索引过滤日期
+            use_bitmap = constants.HOUSE_AVAILABILITY_ENGINE == 'bitmap' and availability.is_ready()
+            # 如果房屋排序索引已经构建,从redis有序集合中获取当前页的房屋id,不再在mysql中排序和分页;
+            # 有日期条件时还需要使用可预订状态位图索引,有设施或关键字条件时在mysql中过滤
+            if cursor is None and not facility_mask and not keyword and house_index.is_ready() \
+                    and (not (start_date or end_date) or use_bitmap):
+                capacity = constants.HOUSE_LIST_PAGE_CAPACITY
+                offset = max(page - 1,0) * capacity
+                if start_date or end_date:
+                    houses_ids = available_houses_ids(redis_key,area_id,sort_key,start_date,end_date)
+                    total_count = len(houses_ids)
+                    page_ids = houses_ids[offset:offset + capacity]
+                else:
+                    total_count = house_index.count(area_id)
+                    page_ids = house_index.range_ids(area_id,sort_key,offset,offset + capacity - 1)
+                total_page = (total_count + capacity - 1) // capacity
+            else:
+                # 定义容器,存储过滤条件,主要是区域信息/日期参数
+                params_filter = []
+                # 判断区域信息的存在
+                if area_id:
+                    """
+                    a = [1,2,3]
+                    b = 1
+                    a.append(a==b)
+                    a=[1,2,3,false]
+                    """
+                    # 列表中添加的是sqlalchemy对象<>
+                    params_filter.append(House.area_id == area_id)
+                # 判断关键字的存在,从倒排索引中获取标题或地址包含关键字的房屋,没有匹配时使用不存在的房屋id 0
+                # 倒排索引尚未构建完成时,在数据库中使用LIKE匹配标题和地址
+                if keyword and search.is_ready():
+                    params_filter.append(House.id.in_(search.search(keyword) or [0]))
+                elif keyword:
+                    pattern = '%%%s%%' % keyword.replace('\\','\\\\').replace('%','\\%').replace('_','\\_')
+                    params_filter.append(or_(House.title.like(pattern,escape='\\'),
+                                             House.address.like(pattern,escape='\\')))
+                # 判断设施条件的存在,房屋的设施位掩码需要包含用户选择的全部设施
+                if facility_mask:
+                    params_filter.append(House.facility_mask.op('&')(facility_mask) == facility_mask)
+                # 在数据库中使用NOT EXISTS关联子查询排除有冲突订单的房屋,已拒单和已取消的订单不算冲突;
+                # 这里不使用位图索引,否则需要先查出全部候选房屋id,再把已被预订的房屋id作为NOT IN参数发回数据库
+                if start_date or end_date:
+                    conflict_filter = [Order.house_id == House.id,Order.status.in_(availability.ACTIVE_ORDER_STATUS)]
+                    # 冲突订单:订单的结束日期不早于用户选择的开始日期,并且订单的开始日期不晚于用户选择的结束日期
+                    if start_date:
+                        conflict_filter.append(Order.end_date >= start_date)
+                    if end_date:
+                        conflict_filter.append(Order.begin_date <= end_date)
+                    params_filter.append(~db.session.query(Order.id).filter(*conflict_filter).exists())
+                # 过滤条件实现后,执行查询排序操作,booking/price-inc/price-des/new,排序值相同时按房屋id排序,保证分页稳定
+                # 只查询房屋id和排序值,房屋数据从房屋摘要缓存中读取
+                houses = House.query.with_entities(House.id,sort_column).filter(*params_filter)
+                if sort_desc:
+                    order_by = (sort_column.desc(),House.id.desc())
+                else:
+                    order_by = (sort_column.asc(),House.id.asc())
+                if cursor is not None:
+                    # 游标分页,只查询排在上一页最后一条记录之后的数据,多查询一条用来判断是否还有下一页
+                    if last_id is not None:
+                        houses = houses.filter(keyset_filter(sort_column,House.id,last_value,last_id,sort_desc))
+                    rows = houses.order_by(*order_by).limit(constants.HOUSE_LIST_PAGE_CAPACITY + 1).all()
+                    next_cursor = None
+                    if len(rows) > constants.HOUSE_LIST_PAGE_CAPACITY:
+                        rows = rows[:constants.HOUSE_LIST_PAGE_CAPACITY]
+                        last_id,last_value = rows[-1]
+                        if sort_column is House.create_time:
+                            last_value = last_value.strftime(CURSOR_TIME_FORMAT)
+                        next_cursor = encode_cursor(last_value,last_id)
+                    page_ids = [house_id for house_id,value in rows]
+                else:
+                    # 对排序结果进行分页操作,page页数/每页条目数/False表示分页异常不报错
+                    houses_page = houses.order_by(*order_by).paginate(page,constants.HOUSE_LIST_PAGE_CAPACITY,False)
+                    # 获取分页后的房屋id和总页数
+                    page_ids = [house_id for house_id,value in houses_page.items]
+                    total_page = houses_page.pages
+            # 当前页的房屋id列表,以及总页数或下一页的游标
+            if cursor is not None:
+                page_data = {'ids':page_ids,'next_cursor':next_cursor}
+            else:
+                page_data = {'ids':page_ids,'total_page':total_page}
+            # 在读取房屋摘要之前计算ETag,批量读取房屋摘要,构造响应报文
+            validator = houses_page_validator(page_data)
+            etag = houses_page_etag(validator)
+            resp_json = render_houses_page(page_data,page)
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.DBERR,errmsg='查询房屋列表信息异常')
+        # 存储当前页的房屋id列表,房屋数据保存在各自的房屋摘要缓存中
+        # 判断用户请求的页数小于分页后的总页数,即用户请求的页数有数据;游标分页判断本页是否有房屋数据
+        if cursor is not None:
+            has_data = bool(page_ids)
+        else:
+            has_data = page <= total_page
+        # 使用查询前获取的redis_key,如果查询期间缓存版本号发生了变化,写入的是已经失效的旧版本缓存
+        if has_data and redis_key:
+            # 可以使用事务,对多条数据同时操作
+            pip = redis_store.pipeline()
+            try:
+                # 开启事务
+                pip.multi()
+                # 存储数据
+                pip.hset(redis_key,cache_field,codec.encode(json.dumps(page_data)))
+                pip.hset(redis_key,'validator_%s' % cache_field,validator)
+                # 设置过期时间
+                pip.expire(redis_key,constants.HOUSE_LIST_REDIS_EXPIRES)
+                # 执行事务
+                pip.execute()
+            except Exception as e:
+                current_app.logger.error(e)
+        # 返回响应数据
+        return etag_response(resp_json,etag)
 
 
 
@@ -1,12 +1,18 @@
 # coding:utf-8
 
+import csv
 import datetime
+import io
+import json
 
-from flask import request, g, jsonify, current_app
-from ihome import db, redis_store
-from ihome.utils.commons import login_required
+from flask import request, g, jsonify, current_app, Response, stream_with_context
+from ihome import db, constants
+from ihome.utils.commons import login_required, encode_cursor, decode_cursor, keyset_filter
 from ihome.utils.response_code import RET
-from ihome.models import House, Order
+from ihome.utils import availability, house_index, house_summary, comments, order_counter
+from ihome.utils.cache import invalidate_houses_list
+from ihome.utils.queries import order_query, landlord_order_query
+from ihome.models import House, Order, OrderArchive
 from . import api
 
 
@@ -39,27 +45,50 @@ def save_order():
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.PARAMERR, errmsg="日期格式错误")
+    # 确保用户预订的时间内，房屋没有被别人下单，检查和占用日期需要对同一房屋串行执行
+    # 位图索引已构建时，在redis中使用lua脚本原子地检查并占用日期
+    use_bitmap = constants.HOUSE_RESERVATION_ENGINE == "bitmap" and availability.is_ready()
     # 查询房屋是否存在
+    # 不使用位图时，查询房屋必须是事务中的第一条语句并使用SELECT ... FOR UPDATE锁定房屋的记录，
+    # 否则之前的普通查询已经建立了一致性快照，加锁后查询冲突订单仍然读取旧的快照
     try:
-        house = House.query.get(house_id)
+        if use_bitmap:
+            house = House.query.get(house_id)
+        else:
+            house = House.query.filter(House.id == house_id).with_for_update().first()
     except Exception as e:
         current_app.logger.error(e)
+        db.session.rollback()
         return jsonify(errno=RET.DBERR, errmsg="获取房屋信息失败")
     if not house:
+        db.session.rollback()
         return jsonify(errno=RET.NODATA, errmsg="房屋不存在")
     # 预订的房屋是否是房东自己的
     if user_id == house.user_id:
+        db.session.rollback()
         return jsonify(errno=RET.ROLEERR, errmsg="不能预订自己的房屋")
-    # 确保用户预订的时间内，房屋没有被别人下单
-    try:
-        # 查询时间冲突的订单数
-        count = Order.query.filter(Order.house_id == house_id,Order.begin_date <= end_date,
-                                   Order.end_date >= start_date).count()
-    except Exception as e:
-        current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR, errmsg="检查出错，请稍候重试")
-    if count > 0:
-        return jsonify(errno=RET.DATAERR, errmsg="房屋已被预订")
+    if use_bitmap:
+        try:
+            reserved = availability.reserve(house_id, start_date, end_date)
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.DBERR, errmsg="检查出错，请稍候重试")
+        if not reserved:
+            return jsonify(errno=RET.DATAERR, errmsg="房屋已被预订")
+    # 否则房屋的记录已被锁定，直到订单保存后提交事务才释放，只有预订同一房屋的请求需要等待
+    else:
+        try:
+            # 查询时间冲突的订单数
+            count = Order.query.filter(Order.house_id == house_id,Order.begin_date <= end_date,
+                                       Order.end_date >= start_date,
+                                       Order.status.in_(availability.ACTIVE_ORDER_STATUS)).count()
+        except Exception as e:
+            current_app.logger.error(e)
+            db.session.rollback()
+            return jsonify(errno=RET.DBERR, errmsg="检查出错，请稍候重试")
+        if count > 0:
+            db.session.rollback()
+            return jsonify(errno=RET.DATAERR, errmsg="房屋已被预订")
     # 订单总额
     amount = days * house.price
     # 保存订单数据
@@ -77,29 +106,103 @@ def save_order():
     except Exception as e:
         current_app.logger.error(e)
         db.session.rollback()
+        # 订单没有保存，释放已经占用的日期
+        if use_bitmap:
+            try:
+                availability.release(house_id, start_date, end_date)
+            except Exception as e:
+                current_app.logger.error(e)
         return jsonify(errno=RET.DBERR, errmsg="保存订单失败")
+    # 没有在下单时占用日期的，在房屋可预订状态位图中占用订单的日期
+    # 房屋的可预订状态发生变化,使所属城区的房屋列表缓存失效
+    try:
+        if not use_bitmap:
+            availability.mark_booked(house_id, start_date, end_date)
+        invalidate_houses_list(house.area_id)
+    except Exception as e:
+        current_app.logger.error(e)
     return jsonify(errno=RET.OK, errmsg="OK", data={"order_id": order.id})
 
 
+def user_orders_query(user_id, role, status=None, archived=False):
+    """
+    用户的订单查询,role为landlord时查询预订了自己房子的订单,否则查询自己预订的订单,按创建时间倒序
+    archived为True时查询已归档的订单
+    """
+    model = OrderArchive if archived else Order
+    if "landlord" == role:
+        # 以房东的身份查询订单，通过房屋表关联房东，一条sql查询预订了自己房子的订单
+        orders = landlord_order_query(user_id, model)
+    else:
+        # 以房客的身份查询订单， 查询自己预订的订单
+        orders = order_query(model).filter(model.user_id == user_id)
+    if status is not None:
+        orders = orders.filter(model.status == status)
+    return orders.order_by(model.create_time.desc(), model.id.desc())
+
+
+def user_orders_sources(archived_only):
+    """
+    查询用户订单时依次读取的表:默认先读取订单表,读完后接着读取归档表;archived_only为True时只读取归档表
+    归档的订单结束日期都早于归档期限,排在订单表中的订单之后
+    """
+    return (True,) if archived_only else (False, True)
+
+
 @api.route("/user/orders", methods=["GET"])
 @login_required
 def get_user_orders():
-    """查询用户的订单信息"""
+    """
+    查询用户的订单信息,订单表中的订单之后接着返回已归档的历史订单
+    status参数只返回该状态的订单;传递cursor参数(第一页为空字符串)时使用键集分页,
+    按(创建时间,订单id)定位上一页的最后一条订单,每页ORDER_LIST_PAGE_CAPACITY条,返回next_cursor用于请求下一页,
+    游标中同时记录最后一条订单所在的表,订单表读完后从归档表的开头继续;
+    archived=1时只查询已归档的历史订单
+    """
     user_id = g.user_id
     # 用户的身份，用户想要查询作为房客预订别人房子的订单，还是想要作为房东查询别人预订自己房子的订单
     role = request.args.get("role", "")
+    status = request.args.get("status")
+    cursor = request.args.get("cursor")
+    sources = user_orders_sources(request.args.get("archived") == "1")
+    if status is not None and status not in Order.status.type.enums:
+        return jsonify(errno=RET.PARAMERR, errmsg="订单状态参数错误")
+    # 对游标进行解码,得到上一页最后一条订单的创建时间、订单id,以及是否在归档表中
+    last_time, last_id, last_archived = None, None, sources[0]
+    if cursor:
+        try:
+            values = decode_cursor(cursor)
+            last_time, last_id = values[:2]
+            last_time = datetime.datetime.strptime(last_time, "%Y-%m-%d %H:%M:%S.%f")
+            last_archived = bool(values[2]) if len(values) > 2 else False
+            assert last_archived in sources
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.PARAMERR, errmsg="游标格式错误")
     # 查询订单数据
     try:
-        if "landlord" == role:
-            # 以房东的身份查询订单
-            # 先查询属于自己的房子有哪些
-            houses = House.query.filter(House.user_id == user_id).all()
-            houses_ids = [house.id for house in houses]
-            # 再查询预订了自己房子的订单
-            orders = Order.query.filter(Order.house_id.in_(houses_ids)).order_by(Order.create_time.desc()).all()
+        next_cursor = None
+        if cursor is not None:
+            # 游标分页,只查询排在上一页最后一条订单之后的数据,多查询一条用来判断是否还有下一页
+            # 订单表中剩余的订单不足一页时,从归档表的开头继续查询
+            rows = []
+            for archived in sources[sources.index(last_archived):]:
+                model = OrderArchive if archived else Order
+                orders = user_orders_query(user_id, role, status, archived)
+                if archived == last_archived and last_id is not None:
+                    orders = orders.filter(keyset_filter(model.create_time, model.id, last_time, last_id, True))
+                rows.extend((archived, order) for order in
+                            orders.limit(constants.ORDER_LIST_PAGE_CAPACITY + 1 - len(rows)))
+                if len(rows) > constants.ORDER_LIST_PAGE_CAPACITY:
+                    break
+            if len(rows) > constants.ORDER_LIST_PAGE_CAPACITY:
+                rows = rows[:constants.ORDER_LIST_PAGE_CAPACITY]
+                archived, order = rows[-1]
+                next_cursor = encode_cursor(order.create_time.strftime("%Y-%m-%d %H:%M:%S.%f"), order.id,
+                                            int(archived))
+            orders = [order for archived, order in rows]
         else:
-            # 以房客的身份查询订单， 查询自己预订的订单
-            orders = Order.query.filter(Order.user_id == user_id).order_by(Order.create_time.desc()).all()
+            orders = [order for archived in sources for order in user_orders_query(user_id, role, status, archived)]
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR, errmsg="查询订单信息失败")
@@ -108,9 +211,64 @@ def get_user_orders():
     if orders:
         for order in orders:
             orders_dict_list.append(order.to_dict())
+    if cursor is not None:
+        return jsonify(errno=RET.OK, errmsg="OK", data={"orders": orders_dict_list, "next_cursor": next_cursor})
     return jsonify(errno=RET.OK, errmsg="OK", data={"orders": orders_dict_list})
 
 
+# 导出订单的字段,与Order.to_dict的键一致
+ORDER_EXPORT_FIELDS = ("order_id", "title", "img_url", "start_date", "end_date", "ctime", "days", "amount",
+                       "status", "comment")
+
+
+@api.route("/user/orders/export", methods=["GET"])
+@login_required
+def export_user_orders():
+    """
+    导出用户的全部订单,包括已归档的历史订单,format为csv(默认)或ndjson,role、status和archived参数与查询订单相同
+    使用服务端游标每次从数据库读取ORDER_EXPORT_BATCH_SIZE条,边查询边返回,占用的内存与订单数量无关
+    """
+    user_id = g.user_id
+    role = request.args.get("role", "")
+    status = request.args.get("status")
+    export_format = request.args.get("format", "csv")
+    sources = user_orders_sources(request.args.get("archived") == "1")
+    if export_format not in ("csv", "ndjson"):
+        return jsonify(errno=RET.PARAMERR, errmsg="导出格式参数错误")
+    if status is not None and status not in Order.status.type.enums:
+        return jsonify(errno=RET.PARAMERR, errmsg="订单状态参数错误")
+
+    def iter_orders():
+        # 订单表导出完后接着导出归档表
+        for archived in sources:
+            for order in user_orders_query(user_id, role, status, archived).yield_per(constants.ORDER_EXPORT_BATCH_SIZE):
+                yield order
+
+    orders = iter_orders()
+
+    def generate_csv():
+        # 每一行写入缓冲区后立即返回并清空缓冲区
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=ORDER_EXPORT_FIELDS)
+        writer.writeheader()
+        for order in orders:
+            writer.writerow(order.to_dict())
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+    def generate_ndjson():
+        for order in orders:
+            yield json.dumps(order.to_dict()) + "\n"
+
+    if export_format == "csv":
+        response = Response(stream_with_context(generate_csv()), mimetype="text/csv")
+    else:
+        response = Response(stream_with_context(generate_ndjson()), mimetype="application/x-ndjson")
+    response.headers["Content-Disposition"] = "attachment; filename=orders.%s" % export_format
+    return response
+
+
 @api.route("/orders/<int:order_id>/status", methods=["PUT"])
 @login_required
 def accept_reject_order(order_id):
@@ -151,9 +309,84 @@ def accept_reject_order(order_id):
         current_app.logger.error(e)
         db.session.rollback()
         return jsonify(errno=RET.DBERR, errmsg="操作失败")
+    # 拒单后释放订单占用的日期,并使所属城区的房屋列表缓存失效
+    if order.status == "REJECTED":
+        try:
+            availability.release(order.house_id, order.begin_date, order.end_date)
+            invalidate_houses_list(house.area_id)
+        except Exception as e:
+            current_app.logger.error(e)
     return jsonify(errno=RET.OK, errmsg="OK")
 
 
+@api.route("/orders/status", methods=["PUT"])
+@login_required
+def batch_accept_reject_orders():
+    """
+    批量接单、拒单
+    一条关联查询确认全部订单属于房东的房子并且处于等待接单状态，在一个事务中使用一条UPDATE修改订单状态，
+    返回每个订单的处理结果
+    """
+    user_id = g.user_id
+    # 获取参数
+    req_data = request.get_json()
+    if not req_data:
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+    action = req_data.get("action")
+    if action not in ("accept", "reject"):
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+    # 拒单，要求用户传递拒单原因
+    reason = req_data.get("reason")
+    if action == "reject" and not reason:
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+    # 订单号去重，并且数量不能超过ORDER_BATCH_MAX_COUNT
+    try:
+        order_ids = []
+        for order_id in req_data.get("order_ids"):
+            if int(order_id) not in order_ids:
+                order_ids.append(int(order_id))
+        assert 0 < len(order_ids) <= constants.ORDER_BATCH_MAX_COUNT
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.PARAMERR, errmsg="订单号参数错误")
+    try:
+        # 查询属于自己房子并且处于等待接单状态的订单，锁定这些订单直到事务提交
+        orders = db.session.query(Order.id, Order.house_id, Order.begin_date, Order.end_date, House.area_id)\
+            .join(House, Order.house_id == House.id)\
+            .filter(Order.id.in_(order_ids), House.user_id == user_id, Order.status == "WAIT_ACCEPT")\
+            .with_for_update().all()
+        valid_ids = [order.id for order in orders]
+        if valid_ids:
+            if action == "accept":
+                # 接单，将订单状态设置为等待评论
+                values = {"status": "WAIT_COMMENT"}
+            else:
+                values = {"status": "REJECTED", "comment": reason}
+            Order.query.filter(Order.id.in_(valid_ids)).update(values, synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        current_app.logger.error(e)
+        db.session.rollback()
+        return jsonify(errno=RET.DBERR, errmsg="操作失败")
+    # 拒单后释放订单占用的日期,并使所属城区的房屋列表缓存失效
+    if action == "reject" and orders:
+        try:
+            for order in orders:
+                availability.release(order.house_id, order.begin_date, order.end_date)
+            for area_id in set(order.area_id for order in orders):
+                invalidate_houses_list(area_id)
+        except Exception as e:
+            current_app.logger.error(e)
+    # 每个订单的处理结果，不属于自己房子或者不是等待接单状态的订单不做修改
+    results = []
+    for order_id in order_ids:
+        if order_id in valid_ids:
+            results.append({"order_id": order_id, "errno": RET.OK, "errmsg": "OK"})
+        else:
+            results.append({"order_id": order_id, "errno": RET.REQERR, "errmsg": "操作无效"})
+    return jsonify(errno=RET.OK, errmsg="OK", data={"results": results})
+
+
 @api.route("/orders/<int:order_id>/comment", methods=["PUT"])
 @login_required
 def save_order_comment(order_id):
@@ -180,18 +413,32 @@ def save_order_comment(order_id):
         order.status = "COMPLETE"
         # 保存订单的评价信息
         order.comment = comment
-        # 将房屋的完成订单数增加1
-        house.order_count += 1
         db.session.add(order)
-        db.session.add(house)
         db.session.commit()
     except Exception as e:
         current_app.logger.error(e)
         db.session.rollback()
         return jsonify(errno=RET.DBERR, errmsg="操作失败")
-    # 因为房屋详情中有订单的评价信息，为了让最新的评价信息展示在房屋详情中，所以删除redis中关于本订单房屋的详情缓存
+    # 将房屋的完成订单数增加1，计入redis计数器，由定时任务批量写入数据库，不在订单事务中修改房屋数据
+    try:
+        order_counter.incr(house.id)
+    except Exception as e:
+        current_app.logger.error(e)
+        # redis不可用时直接在数据库中原子地增加
+        try:
+            House.query.filter_by(id=house.id).update({"order_count": House.order_count + 1},
+                                                      synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            current_app.logger.error(e)
+            db.session.rollback()
+    # 把评价插入到房屋的评论列表中，房屋详情缓存中不包含评论，不需要删除
+    # 房屋的完成订单数发生变化，删除房屋摘要缓存，更新按成交次数排序的索引，并使房屋列表缓存失效
     try:
-        redis_store.delete("house_info_%s" % order.house.id)
+        comments.push(house.id, json.dumps(order.to_comment_dict()))
+        house_summary.invalidate(house.id)
+        house_index.incr_order_count(house)
+        invalidate_houses_list(house.area_id)
     except Exception as e:
         current_app.logger.error(e)
 
@@ -7,11 +7,13 @@ from flask import request,jsonify,current_app,session,g
 # 导入自定义的状态码
 from ihome.utils.response_code import RET
 # 导入模型类User
-from ihome.models import User
+from ihome.models import User,House
 # 导入登陆验证装饰器
 from ihome.utils.commons import login_required
 # 导入七牛云接口
 from ihome.utils.image_storage import storage
+# 导入房屋摘要缓存
+from ihome.utils import house_summary
 # 导入数据库实例
 from ihome import db, constants
 
@@ -136,6 +138,11 @@ def set_user_avatar():
         current_app.logger.error(e)
         db.session.rollback()
         return jsonify(errno=RET.DBERR,errmsg='保存用户头像失败')
+    # 房屋摘要中包含房东头像,删除该用户全部房屋的摘要缓存
+    try:
+        house_summary.invalidate(*[house_id for house_id, in db.session.query(House.id).filter_by(user_id=user_id)])
+    except Exception as e:
+        current_app.logger.error(e)
     # 返回前端图片的绝对路径
     image_url = constants.QINIU_DOMIN_PREFIX + image_name
     # 返回结果
@@ -18,14 +18,97 @@ HOME_PAGE_MAX_HOUSES = 5
 # 首页房屋数据的Redis缓存时间，单位：秒
 HOME_PAGE_DATA_REDIS_EXPIRES = 7200
 
+# 首页房屋数据的新鲜期，超过后先返回旧数据，同时在后台重建，单位：秒
+HOME_PAGE_DATA_SOFT_EXPIRES = 1800
+
 # 房屋详情页展示的评论最大数
 HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS = 30
 
 # 房屋详情页面数据Redis缓存时间，单位：秒
 HOUSE_DETAIL_REDIS_EXPIRE_SECOND = 7200
 
+# 房屋详情页面数据的新鲜期，超过后先返回旧数据，同时在后台重建，单位：秒
+HOUSE_DETAIL_SOFT_EXPIRE_SECOND = 1800
+
+# 房屋评论列表Redis缓存时间，单位：秒
+HOUSE_COMMENTS_REDIS_EXPIRES = 7200
+
 # 房屋列表页面每页显示条目数
 HOUSE_LIST_PAGE_CAPACITY = 2
 
 # 房屋列表页面Redis缓存时间，单位：秒
 HOUSE_LIST_REDIS_EXPIRES = 7200
+
+# 房屋摘要(列表页中的房屋基本信息)Redis缓存时间，单位：秒
+HOUSE_SUMMARY_REDIS_EXPIRES = 7200
+
+# 房屋可预订状态位图的起始日期,位图偏移量为距离该日期的天数
+HOUSE_CALENDAR_EPOCH = "2018-01-01"
+
+# 房屋预订日历默认返回的月数
+HOUSE_CALENDAR_DEFAULT_MONTHS = 3
+
+# 房屋预订日历最多返回的月数
+HOUSE_CALENDAR_MAX_MONTHS = 12
+
+# 房屋列表日期过滤的实现方式:bitmap为可预订状态位图索引(未构建时使用anti_join),anti_join为数据库中的NOT EXISTS子查询
+HOUSE_AVAILABILITY_ENGINE = "bitmap"
+
+# 下单时检查并占用房屋日期的实现方式:bitmap为在可预订状态位图上执行lua脚本(未构建时使用row_lock),
+# row_lock为使用SELECT ... FOR UPDATE锁定房屋记录
+HOUSE_RESERVATION_ENGINE = "bitmap"
+
+# 房屋设施位掩码支持的最大设施编号,设施编号对应掩码中的位
+HOUSE_FACILITY_MAX_ID = 62
+
+# 缓存重建锁的有效期,单位：秒
+CACHE_FILL_LOCK_EXPIRES = 10
+
+# 缓存重建时其它请求等待重建结果的最长时间,单位：秒
+CACHE_FILL_WAIT_SECOND = 2
+
+# 设施信息redis缓存时间，单位：秒
+FACILITY_INFO_REDIS_EXPIRES = 7200
+
+# 进程内一级缓存的最大条目数
+LOCAL_CACHE_MAX_SIZE = 1000
+
+# 进程内一级缓存的有效期，单位：秒
+LOCAL_CACHE_EXPIRES = 300
+
+# 写入首页缓存时是否同时保存响应的压缩版本(gzip,安装brotli时还有br),按Accept-Encoding直接返回
+# 房屋详情和列表页的响应在每次请求时拼接,不保存压缩版本
+CACHE_PRECOMPRESS = True
+
+# 需要保存压缩版本的最小响应长度，单位：字节
+CACHE_PRECOMPRESS_MIN_SIZE = 1024
+
+# 缓存的json字符串需要使用zlib压缩的最小长度，单位：字节
+CACHE_CODEC_COMPRESS_MIN_SIZE = 512
+
+# 缓存访问次数有序集合保留的最大条目数
+CACHE_POPULARITY_MAX_SIZE = 10000
+
+# 预热缓存时重放的最热门请求数
+CACHE_WARM_TOP = 200
+
+# 预热缓存时同时执行的请求数
+CACHE_WARM_CONCURRENCY = 4
+
+# 批量获取房屋详情时一次请求的最大房屋数
+HOUSE_BATCH_MAX_COUNT = 20
+
+# 订单列表键集分页时每页显示条目数
+ORDER_LIST_PAGE_CAPACITY = 10
+
+# 导出订单时每次从数据库读取的订单数
+ORDER_EXPORT_BATCH_SIZE = 500
+
+# 批量接单、拒单时一次请求的最大订单数
+ORDER_BATCH_MAX_COUNT = 200
+
+# 归档结束日期早于多少天前的订单，单位：天
+ORDER_ARCHIVE_DAYS = 180
+
+# 每批归档的订单数
+ORDER_ARCHIVE_BATCH_SIZE = 1000
@@ -1,6 +1,7 @@
 # -*- coding:utf-8 -*-
 
 from datetime import datetime
+from sqlalchemy.orm import joinedload
 from werkzeug.security import generate_password_hash, check_password_hash
 from ihome import constants
 from . import db
@@ -112,10 +113,19 @@ class House(BaseModel, db.Model):
     max_days = db.Column(db.Integer, default=0)  # 最多入住天数，0表示不限制
     order_count = db.Column(db.Integer, default=0)  # 预订完成的该房屋的订单数
     index_image_url = db.Column(db.String(256), default="")  # 房屋主图片的路径
+    facility_mask = db.Column(db.BigInteger, default=0, server_default="0", nullable=False)  # 房屋设施的位掩码
     facilities = db.relationship("Facility", secondary=house_facility)  # 房屋的设施
     images = db.relationship("HouseImage")  # 房屋的图片
     orders = db.relationship("Order", backref="house")  # 房屋的订单
 
+    @staticmethod
+    def facility_mask_of(facility_ids):
+        """把设施编号转换为位掩码,设施编号对应掩码中的位"""
+        mask = 0
+        for facility_id in facility_ids:
+            mask |= 1 << int(facility_id)
+        return mask
+
     def to_basic_dict(self):
         """将基本信息转换为字典数据"""
         house_dict = {
@@ -132,8 +142,8 @@ class House(BaseModel, db.Model):
         }
         return house_dict
 
-    def to_full_dict(self):
-        """将详细信息转换为字典数据"""
+    def to_full_dict(self, comment_orders=None):
+        """将详细信息转换为字典数据,comment_orders为已经查询出的评论订单,未传递时查询该房屋的评论"""
         house_dict = {
             "hid": self.id,
             "user_id": self.user_id,
@@ -166,15 +176,12 @@ class House(BaseModel, db.Model):
 
         # 评论信息
         comments = []
-        orders = Order.query.filter(Order.house_id == self.id, Order.status == "COMPLETE", Order.comment != None)\
-            .order_by(Order.update_time.desc()).limit(constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS)
-        for order in orders:
-            comment = {
-                "comment": order.comment,  # 评论的内容
-                "user_name": order.user.name if order.user.name != order.user.mobile else "匿名用户",  # 发表评论的用户
-                "ctime": order.update_time.strftime("%Y-%m-%d %H:%M:%S")  # 评价的时间
-            }
-            comments.append(comment)
+        if comment_orders is None:
+            comment_orders = Order.query.options(joinedload("user"))\
+                .filter(Order.house_id == self.id, Order.status == "COMPLETE", Order.comment != None)\
+                .order_by(Order.update_time.desc()).limit(constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS)
+        for order in comment_orders:
+            comments.append(order.to_comment_dict())
         house_dict["comments"] = comments
         return house_dict
 
@@ -224,6 +231,15 @@ class Order(BaseModel, db.Model):
         default="WAIT_ACCEPT", index=True)
     comment = db.Column(db.Text)  # 订单的评论信息或者拒单原因
 
+    __table_args__ = (
+        # 检查房屋在日期范围内是否有冲突订单时使用的联合索引
+        db.Index("ix_ih_order_info_house_id_begin_date_end_date", "house_id", "begin_date", "end_date"),
+        # 房东按创建时间查询订单时使用的联合索引
+        db.Index("ix_ih_order_info_house_id_create_time", "house_id", "create_time"),
+        # 按评价时间查询房屋最新评论时使用的联合索引
+        db.Index("ix_ih_order_info_house_id_status_update_time", "house_id", "status", "update_time"),
+    )
+
     def to_dict(self):
         """将订单信息转换为字典数据"""
         order_dict = {
@@ -240,3 +256,50 @@ class Order(BaseModel, db.Model):
         }
         return order_dict
 
+    def to_comment_dict(self):
+        """将订单的评价信息转换为字典数据"""
+        comment_dict = {
+            "comment": self.comment,  # 评论的内容
+            "user_name": self.user.name if self.user.name != self.user.mobile else "匿名用户",  # 发表评论的用户
+            "ctime": self.update_time.strftime("%Y-%m-%d %H:%M:%S")  # 评价的时间
+        }
+        return comment_dict
+
+
+
+class OrderArchive(BaseModel, db.Model):
+    """已归档的订单,字段与订单相同,保存结束日期早于归档期限的已完成、已取消、已拒单订单"""
+
+    __tablename__ = "ih_order_archive"
+
+    id = db.Column(db.Integer, primary_key=True)  # 订单编号,与归档前相同
+    user_id = db.Column(db.Integer, db.ForeignKey("ih_user_profile.id"), nullable=False, index=True)  # 下订单的用户编号
+    house_id = db.Column(db.Integer, db.ForeignKey("ih_house_info.id"), nullable=False)  # 预订的房间编号
+    begin_date = db.Column(db.DateTime, nullable=False)  # 预订的起始时间
+    end_date = db.Column(db.DateTime, nullable=False)  # 预订的结束时间
+    days = db.Column(db.Integer, nullable=False)  # 预订的总天数
+    house_price = db.Column(db.Integer, nullable=False)  # 房屋的单价
+    amount = db.Column(db.Integer, nullable=False)  # 订单的总金额
+    status = db.Column(  # 订单的状态
+        db.Enum(
+            "WAIT_ACCEPT",  # 待接单,
+            "WAIT_PAYMENT",  # 待支付
+            "PAID",  # 已支付
+            "WAIT_COMMENT",  # 待评价
+            "COMPLETE",  # 已完成
+            "CANCELED",  # 已取消
+            "REJECTED"  # 已拒单
+        ),
+        default="WAIT_ACCEPT", index=True)
+    comment = db.Column(db.Text)  # 订单的评论信息或者拒单原因
+    house = db.relationship("House")  # 预订的房屋
+    user = db.relationship("User")  # 下订单的用户
+
+    __table_args__ = (
+        # 按房屋查询订单和评论时使用的联合索引
+        db.Index("ix_ih_order_archive_house_id_create_time", "house_id", "create_time"),
+        db.Index("ix_ih_order_archive_house_id_status_update_time", "house_id", "status", "update_time"),
+    )
+
+    to_dict = Order.to_dict
+    to_comment_dict = Order.to_comment_dict
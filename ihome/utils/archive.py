@@ -0,0 +1,44 @@
+# -*- coding:utf-8 -*-
+"""
+订单归档
+订单表只增不减,冲突检查和订单查询使用的索引中大部分是早已结束的订单.
+定时执行python manage.py archive_orders,把结束日期早于归档期限的已完成、已取消、已拒单订单
+分批转移到归档表ih_order_archive中,订单表只保留仍然有效或者刚结束的订单.
+归档订单的日期都早于归档期限,不会与新的预订冲突;查询历史订单时传递archived参数读取归档表,
+房屋详情中的评论不足展示数量时再从归档表补充.
+"""
+
+import datetime
+
+from sqlalchemy import select
+
+from ihome import db
+from ihome.models import Order, OrderArchive
+
+# 可以归档的订单状态
+TERMINAL_ORDER_STATUS = ("COMPLETE", "CANCELED", "REJECTED")
+
+
+def archive_orders(days, batch_size):
+    """把结束日期早于days天前的订单转移到归档表,每批batch_size条,每批一个事务,返回归档的订单数"""
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+    order_columns = [column.name for column in Order.__table__.columns]
+    archived = 0
+    while True:
+        order_ids = [order_id for order_id, in db.session.query(Order.id)
+                     .filter(Order.status.in_(TERMINAL_ORDER_STATUS), Order.end_date < cutoff)
+                     .order_by(Order.id).limit(batch_size)]
+        if not order_ids:
+            break
+        try:
+            # INSERT ... SELECT复制到归档表后,删除订单表中的记录
+            db.session.execute(OrderArchive.__table__.insert().from_select(
+                order_columns,
+                select([Order.__table__.c[name] for name in order_columns]).where(Order.id.in_(order_ids))))
+            Order.query.filter(Order.id.in_(order_ids)).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        archived += len(order_ids)
+    return archived
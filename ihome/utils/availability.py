@@ -0,0 +1,189 @@
+# -*- coding:utf-8 -*-
+"""
+房屋可预订状态索引
+每个房屋在redis中保存一个按天划分的位图,键为house_calendar_<house_id>,
+位的偏移量为距离HOUSE_CALENDAR_EPOCH的天数,位为1表示当天已被有效订单占用.
+判断房屋在某个日期范围内是否空闲,只需要对位图做范围查询,不再需要扫描订单表.
+下单时使用lua脚本在redis中原子地检查并占用日期(reserve),同一房屋的预订请求在redis中串行执行,
+不同房屋之间互不影响.
+"""
+
+import datetime
+
+from ihome import constants, db, redis_store, redis_binary_store
+from ihome.models import House, Order
+
+# 位图索引的起始日期
+EPOCH = datetime.datetime.strptime(constants.HOUSE_CALENDAR_EPOCH, '%Y-%m-%d').date()
+
+# 会占用房屋日期的订单状态,已拒单和已取消的订单不占用
+ACTIVE_ORDER_STATUS = ("WAIT_ACCEPT", "WAIT_PAYMENT", "PAID", "WAIT_COMMENT", "COMPLETE")
+
+# 日期范围内的位全部为0时把它们设置为1并返回1,否则不做修改并返回0
+_RESERVE_SCRIPT = """
+local first = tonumber(ARGV[1])
+local last = tonumber(ARGV[2])
+for offset = first, last do
+    if redis.call('getbit', KEYS[1], offset) == 1 then
+        return 0
+    end
+end
+for offset = first, last do
+    redis.call('setbit', KEYS[1], offset, 1)
+end
+return 1
+"""
+
+
+def calendar_key(house_id):
+    """房屋位图在redis中的键"""
+    return 'house_calendar_%s' % house_id
+
+
+def day_offset(date):
+    """日期距离起始日期的天数,即位图中的偏移量"""
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    return max((date - EPOCH).days, 0)
+
+
+def is_ready():
+    """位图索引是否已经完整构建,未构建时调用方需要回退到数据库查询"""
+    return bool(redis_store.get('house_calendar_ready'))
+
+
+def _set_range(house_id, begin_date, end_date, value):
+    """把房屋在[begin_date,end_date]内每天对应的位设置为value"""
+    key = calendar_key(house_id)
+    pip = redis_store.pipeline()
+    for offset in range(day_offset(begin_date), day_offset(end_date) + 1):
+        pip.setbit(key, offset, value)
+    pip.execute()
+
+
+def mark_booked(house_id, begin_date, end_date):
+    """订单生效,占用房屋的日期"""
+    _set_range(house_id, begin_date, end_date, 1)
+
+
+def release(house_id, begin_date, end_date):
+    """订单被拒或取消,释放房屋的日期"""
+    _set_range(house_id, begin_date, end_date, 0)
+
+
+def reserve(house_id, begin_date, end_date):
+    """原子地检查并占用房屋在[begin_date,end_date]内的日期,日期已被占用时返回False"""
+    return bool(redis_store.eval(_RESERVE_SCRIPT, 1, calendar_key(house_id),
+                                 day_offset(begin_date), day_offset(end_date)))
+
+
+def _queue_range_check(pip, key, first, last):
+    """
+    把检查位图[first,last]范围内是否存在为1的位的命令加入管道,返回加入的命令数
+    BITCOUNT只支持按字节划分范围,所以两端不足一个字节的部分使用GETBIT逐位检查;
+    last为None表示一直检查到位图末尾
+    """
+    if last is not None and last - first < 16:
+        for offset in range(first, last + 1):
+            pip.getbit(key, offset)
+        return last - first + 1
+    # 第一个完整字节
+    start_byte = (first + 7) // 8
+    count = 0
+    for offset in range(first, start_byte * 8):
+        pip.getbit(key, offset)
+        count += 1
+    if last is None:
+        pip.bitcount(key, start_byte, -1)
+        return count + 1
+    # 最后一个完整字节
+    end_byte = (last + 1) // 8 - 1
+    pip.bitcount(key, start_byte, end_byte)
+    count += 1
+    for offset in range((end_byte + 1) * 8, last + 1):
+        pip.getbit(key, offset)
+        count += 1
+    return count
+
+
+def filter_booked(house_ids, start_date=None, end_date=None):
+    """
+    从house_ids中找出在日期范围内已被预订的房屋
+    start_date为None表示从最早的日期开始,end_date为None表示直到最晚的日期
+    """
+    first = day_offset(start_date) if start_date else 0
+    last = day_offset(end_date) if end_date else None
+    pip = redis_store.pipeline()
+    counts = []
+    for house_id in house_ids:
+        counts.append(_queue_range_check(pip, calendar_key(house_id), first, last))
+    results = pip.execute()
+    booked_ids = []
+    index = 0
+    for house_id, count in zip(house_ids, counts):
+        if any(results[index:index + count]):
+            booked_ids.append(house_id)
+        index += count
+    return booked_ids
+
+
+def _runs(days):
+    """把按日期排列的(日期,是否已被预订)合并为已被预订的连续日期范围[(开始日期,结束日期)]"""
+    ranges = []
+    for date, booked in days:
+        if not booked:
+            continue
+        if ranges and ranges[-1][1] + datetime.timedelta(days=1) == date:
+            ranges[-1][1] = date
+        else:
+            ranges.append([date, date])
+    return [tuple(date_range) for date_range in ranges]
+
+
+def booked_ranges(house_id, start_date, end_date):
+    """
+    房屋在[start_date,end_date]内已被预订的连续日期范围,按行程编码返回[(开始日期,结束日期)]
+    使用GETRANGE一次读取范围内的位图字节,位图中字节的最高位对应最小的偏移量
+    """
+    first, last = day_offset(start_date), day_offset(end_date)
+    data = redis_binary_store.getrange(calendar_key(house_id), first // 8, last // 8)
+    days = []
+    for offset in range(first, last + 1):
+        index = offset // 8 - first // 8
+        booked = index < len(data) and bool(data[index] >> (7 - offset % 8) & 1)
+        days.append((EPOCH + datetime.timedelta(days=offset), booked))
+    return _runs(days)
+
+
+def booked_ranges_from_orders(house_id, start_date, end_date):
+    """位图索引未构建时,从数据库中的有效订单计算房屋在[start_date,end_date]内已被预订的连续日期范围"""
+    orders = db.session.query(Order.begin_date, Order.end_date)\
+        .filter(Order.house_id == house_id, Order.begin_date <= end_date, Order.end_date >= start_date,
+                Order.status.in_(ACTIVE_ORDER_STATUS))
+    first, last = day_offset(start_date), day_offset(end_date)
+    booked_offsets = set()
+    for order_begin, order_end in orders:
+        booked_offsets.update(range(max(day_offset(order_begin), first), min(day_offset(order_end), last) + 1))
+    return _runs((EPOCH + datetime.timedelta(days=offset), offset in booked_offsets)
+                 for offset in range(first, last + 1))
+
+
+def rebuild():
+    """根据数据库中的有效订单重建所有房屋的位图索引"""
+    redis_store.delete('house_calendar_ready')
+    house_ids = [house_id for house_id, in db.session.query(House.id)]
+    pip = redis_store.pipeline()
+    for house_id in house_ids:
+        pip.delete(calendar_key(house_id))
+    pip.execute()
+    orders = db.session.query(Order.house_id, Order.begin_date, Order.end_date)\
+        .filter(Order.status.in_(ACTIVE_ORDER_STATUS)).yield_per(1000)
+    pip = redis_store.pipeline(transaction=False)
+    for house_id, begin_date, end_date in orders:
+        for offset in range(day_offset(begin_date), day_offset(end_date) + 1):
+            pip.setbit(calendar_key(house_id), offset, 1)
+        if len(pip) >= 10000:
+            pip.execute()
+    pip.execute()
+    redis_store.set('house_calendar_ready', 1)
+    return len(house_ids)
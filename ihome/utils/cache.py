@@ -0,0 +1,310 @@
+# -*- coding:utf-8 -*-
+"""
+redis缓存的通用设施
+房屋列表页的缓存键中折叠了缓存版本号:全局版本号houses_gen,以及城区版本号houses_gen_area_<area_id>
+(不限城区的列表使用houses_gen_area_all).房屋数据变化时只需要INCR对应的版本号,
+旧版本号下的缓存不会再被读取,等待过期即可,不需要遍历删除缓存键.
+缓存失效后使用single_flight合并并发的重建请求,避免大量请求同时查询mysql.
+首页和房屋详情缓存使用两个有效期:超过新鲜期(fresh_<key>过期)后先返回旧数据,
+同时在后台线程中重建,只有超过redis中的有效期后才需要在请求中查询mysql.
+写入缓存时同时保存缓存数据的ETag(etag_<key>),
+客户端带有If-None-Match时只需要读取并比较ETag,一致时直接返回304,不需要读取缓存数据.
+房屋详情的ETag由详情缓存的ETag和评论列表的版本号组成,列表页的ETag由页面的验证值和各房屋摘要的版本号计算,
+评论或者房屋摘要变化时版本号增加,同样不需要读取和拼接缓存数据就能验证.
+开启CACHE_PRECOMPRESS时,写入缓存的同时保存完整响应的压缩版本(<编码>_<key>),
+客户端可接受时直接返回压缩数据,每次写入缓存只压缩一次,而不是每次响应都压缩.
+预先压缩只用于首页:房屋详情的响应需要拼接评论和用户身份,列表页缓存只保存房屋id,
+每次响应时才从房屋摘要缓存拼接出完整数据,这些响应没有可以预先压缩的固定内容.
+缓存数据使用codec编码后写入redis,读取时解码为json字符串.
+房屋详情和列表页的请求记录在有序集合cache_popularity中(成员为请求路径,分值为请求次数),
+部署或者redis清空后由manage.py cache warm按访问次数重放最热门的请求,预先写入缓存.
+"""
+
+import gzip
+import hashlib
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import current_app, make_response, request
+
+from ihome import constants, redis_store, redis_binary_store
+from ihome.utils import codec
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 支持的压缩编码,按优先级排列
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# 本进程内正在重建的缓存,键为缓存名,值为[锁,等待的线程数]
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# 只有持有者才能释放缓存重建锁
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+# 缓存访问次数的有序集合
+POPULARITY_KEY = 'cache_popularity'
+
+# 预热缓存的请求带有该请求头,不计入访问次数
+WARM_HEADER = 'X-Cache-Warm'
+
+
+def record_hit():
+    """把当前请求的路径计入访问次数,偶尔裁剪有序集合,只保留访问次数最多的CACHE_POPULARITY_MAX_SIZE条"""
+    if request.headers.get(WARM_HEADER):
+        return
+    pip = redis_store.pipeline(transaction=False)
+    pip.zincrby(POPULARITY_KEY, request.full_path.rstrip('?'), 1)
+    if random.random() < 0.01:
+        pip.zremrangebyrank(POPULARITY_KEY, 0, -constants.CACHE_POPULARITY_MAX_SIZE - 1)
+    pip.execute()
+
+
+def popular_paths(count):
+    """访问次数最多的count个请求路径"""
+    return redis_store.zrevrange(POPULARITY_KEY, 0, count - 1)
+
+
+def _area_generation_key(area_id):
+    """城区缓存版本号的键,area_id为空表示不限城区的列表"""
+    return 'houses_gen_area_%s' % (area_id or 'all')
+
+
+def houses_list_key(area_id, start_date_str, end_date_str, sort_key, facility_str='', keyword=''):
+    """房屋列表页缓存的键,facility_str为规范化(去重排序)后的设施编号,keyword为搜索关键字"""
+    global_gen, area_gen = redis_store.mget('houses_gen', _area_generation_key(area_id))
+    return u'houses_%s_%s_%s_%s_%s_%s_%s_%s' % (global_gen or 0, area_gen or 0, area_id, start_date_str, end_date_str,
+                                              sort_key, facility_str, keyword)
+
+
+def invalidate_houses_list(area_id=None):
+    """
+    使房屋列表页缓存失效
+    area_id为None时递增全局版本号,所有列表页失效;
+    否则递增该城区以及不限城区列表的版本号,其它城区的列表页不受影响
+    """
+    if area_id is None:
+        redis_store.incr('houses_gen')
+        return
+    pip = redis_store.pipeline()
+    pip.incr(_area_generation_key(area_id))
+    pip.incr(_area_generation_key(None))
+    pip.execute()
+
+
+def _enter_inflight(key):
+    """登记本进程内对缓存的重建,返回该缓存的进程内锁"""
+    with _inflight_lock:
+        entry = _inflight.get(key)
+        if entry is None:
+            entry = _inflight[key] = [threading.Lock(), 0]
+        entry[1] += 1
+    return entry
+
+
+def _leave_inflight(key, entry):
+    """注销本进程内对缓存的重建,没有线程等待时移除该缓存的锁"""
+    with _inflight_lock:
+        entry[1] -= 1
+        if not entry[1]:
+            _inflight.pop(key, None)
+
+
+@contextmanager
+def single_flight(key):
+    """
+    合并并发的缓存重建:同一时刻只有一个请求查询数据库重建缓存
+    本进程内的线程先在进程内锁上排队,再通过redis中的锁lock_<key>与其它进程协调,
+    排队和等待redis锁的时间合计最多CACHE_FILL_WAIT_SECOND秒,超时后不再等待持有者重建完成.
+    with语句块内需要重新读取一次缓存,命中时直接返回,未命中(等待超时或重建失败)时再查询数据库:
+        with single_flight('area_info'):
+            areas = redis_store.get('area_info')
+            if areas:
+                return ...
+            ...查询数据库,写入缓存...
+    """
+    entry = _enter_inflight(key)
+    # 进程内排队和等待redis锁的总时间不超过CACHE_FILL_WAIT_SECOND秒
+    deadline = time.time() + constants.CACHE_FILL_WAIT_SECOND
+    locked = entry[0].acquire(timeout=constants.CACHE_FILL_WAIT_SECOND)
+    try:
+        # 等待本进程内的持有者超时,不再等待redis锁,直接重新读取缓存,未命中时查询数据库
+        if not locked:
+            yield
+            return
+        lock_key = 'lock_%s' % key
+        token = uuid.uuid4().hex
+        acquired = False
+        try:
+            acquired = redis_store.set(lock_key, token, ex=constants.CACHE_FILL_LOCK_EXPIRES, nx=True)
+            if not acquired:
+                while time.time() < deadline and redis_store.exists(lock_key):
+                    time.sleep(0.05)
+        except Exception as e:
+            # redis不可用时不再协调,直接查询数据库
+            current_app.logger.error(e)
+        try:
+            yield
+        finally:
+            if acquired:
+                try:
+                    redis_store.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+                except Exception as e:
+                    current_app.logger.error(e)
+    finally:
+        if locked:
+            entry[0].release()
+        _leave_inflight(key, entry)
+
+
+def get_with_freshness(key):
+    """读取使用新鲜期的缓存,返回(缓存数据,是否已超过新鲜期,ETag)"""
+    value, fresh, etag = redis_binary_store.mget(key, 'fresh_%s' % key, etag_key(key))
+    return codec.decode(value), value is not None and fresh is None, etag.decode('utf-8') if etag else None
+
+
+def set_with_freshness(key, value, soft_expires, hard_expires, body=None):
+    """
+    写入使用新鲜期的缓存,soft_expires为新鲜期,hard_expires为redis中的有效期,返回缓存数据的ETag
+    body为使用缓存数据构造的完整响应,传递时同时保存它的压缩版本
+    """
+    etag = make_etag(value)
+    pip = redis_binary_store.pipeline()
+    pip.setex(key, hard_expires, codec.encode(value))
+    pip.setex('fresh_%s' % key, soft_expires, 1)
+    pip.setex(etag_key(key), hard_expires, etag)
+    if body is not None:
+        for encoding, data in compress_variants(body).items():
+            pip.setex('%s_%s' % (encoding, key), hard_expires, data)
+    pip.execute()
+    return etag
+
+
+def refresh_in_background(key, build, *args):
+    """
+    在后台线程中调用build(*args)重建超过新鲜期的缓存
+    与single_flight使用同一把redis锁,同一时刻只有一个请求在重建该缓存
+    """
+    lock_key = 'lock_%s' % key
+    token = uuid.uuid4().hex
+    if not redis_store.set(lock_key, token, ex=constants.CACHE_FILL_LOCK_EXPIRES, nx=True):
+        return
+    app = current_app._get_current_object()
+
+    def refresh():
+        with app.app_context():
+            try:
+                build(*args)
+            except Exception as e:
+                app.logger.error(e)
+            finally:
+                try:
+                    redis_store.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+                except Exception as e:
+                    app.logger.error(e)
+
+    thread = threading.Thread(target=refresh, name='cache-refresh')
+    thread.daemon = True
+    thread.start()
+
+
+def etag_key(key):
+    """缓存数据的ETag在redis中的键"""
+    return 'etag_%s' % key
+
+
+def make_etag(value):
+    """计算缓存数据的ETag"""
+    return hashlib.md5(value.encode('utf-8')).hexdigest()
+
+
+def _matched_etag(etag):
+    """
+    请求头If-None-Match中包含的etag或者它的压缩版本的etag(<etag>-<编码>),不包含时返回None
+    """
+    if not etag:
+        return None
+    for tag in [etag] + ['%s-%s' % (etag, encoding) for encoding in ENCODINGS]:
+        if tag in request.if_none_match:
+            return tag
+    return None
+
+
+def is_not_modified(etag):
+    """请求头If-None-Match中是否包含etag,即客户端缓存的数据与服务器一致"""
+    return _matched_etag(etag) is not None
+
+
+def not_modified(etag):
+    """304响应,返回客户端持有的那个版本的etag"""
+    response = make_response('', 304)
+    response.set_etag(_matched_etag(etag) or etag)
+    if constants.CACHE_PRECOMPRESS:
+        response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def etag_response(body, etag):
+    """返回带有ETag的响应,客户端缓存的数据与服务器一致时返回304"""
+    if is_not_modified(etag):
+        return not_modified(etag)
+    response = make_response(body)
+    if etag:
+        response.set_etag(etag)
+    if constants.CACHE_PRECOMPRESS:
+        response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def compress_variants(body):
+    """生成响应的压缩版本,返回{编码:压缩数据},未开启或响应太短时返回空字典"""
+    if not constants.CACHE_PRECOMPRESS or len(body) < constants.CACHE_PRECOMPRESS_MIN_SIZE:
+        return {}
+    data = body.encode('utf-8')
+    variants = {'gzip': gzip.compress(data)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data)
+    return variants
+
+
+def accepted_encoding():
+    """客户端可接受的压缩编码,不接受压缩或未开启时返回None"""
+    if not constants.CACHE_PRECOMPRESS:
+        return None
+    for encoding in ENCODINGS:
+        if request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def get_compressed(key):
+    """读取客户端可接受的压缩版本,返回(编码,压缩数据,ETag,是否已超过新鲜期),没有压缩版本时编码为None"""
+    encoding = accepted_encoding()
+    if encoding is None:
+        return None, None, None, False
+    data, etag, fresh = redis_binary_store.mget('%s_%s' % (encoding, key), etag_key(key), 'fresh_%s' % key)
+    if data is None:
+        return None, None, None, False
+    return encoding, data, etag.decode('utf-8') if etag else None, fresh is None
+
+
+def compressed_response(data, encoding, etag):
+    """返回压缩后的响应,压缩版本使用单独的etag"""
+    response = make_response(data)
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    if etag:
+        response.set_etag('%s-%s' % (etag, encoding))
+    return response
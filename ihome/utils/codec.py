@@ -0,0 +1,58 @@
+# -*- coding:utf-8 -*-
+"""
+redis缓存数据的编码
+缓存中保存json字符串本身,超过CACHE_CODEC_COMPRESS_MIN_SIZE时使用zlib压缩,减少占用的内存和网络传输;
+读取时只需要解压,不需要反序列化再重新序列化为json字符串.
+编码结果的第一个字节记录编码方式,读取时按该字节解码;之前使用msgpack编码写入的缓存在过期前仍然可以读取.
+调用方读写的仍然是json字符串,ETag和响应报文的构造不受影响;编码后的数据是二进制,需要使用redis_binary_store读取.
+"""
+
+import json
+import zlib
+
+from ihome import constants
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# 编码方式对应的标记字节,压缩后的数据使用大写字母;msgpack只用于读取旧的缓存
+JSON = b'j'
+MSGPACK = b'm'
+COMPRESSED = {JSON: b'J', MSGPACK: b'M'}
+
+
+def _unpack(flag, data):
+    """把数据解码为json字符串"""
+    if flag == MSGPACK:
+        return json.dumps(msgpack.unpackb(data, raw=False))
+    return data.decode('utf-8')
+
+
+def encode(text):
+    """编码写入缓存的json字符串"""
+    flag, data = JSON, text.encode('utf-8')
+    if len(data) >= constants.CACHE_CODEC_COMPRESS_MIN_SIZE:
+        flag, data = COMPRESSED[flag], zlib.compress(data)
+    return flag + data
+
+
+def decode(data):
+    """解码从缓存中读取的数据,返回json字符串,data为None时返回None"""
+    if data is None:
+        return None
+    flag = data[:1]
+    # 没有标记字节的是编码前写入的json字符串
+    if flag not in (JSON, MSGPACK) and flag not in COMPRESSED.values():
+        return data.decode('utf-8')
+    data = data[1:]
+    for plain_flag, compressed_flag in COMPRESSED.items():
+        if flag == compressed_flag:
+            flag, data = plain_flag, zlib.decompress(data)
+    return _unpack(flag, data)
+
+
+def sizes(text):
+    """json字符串和编码后的数据分别占用的字节数,用来比较编码的效果"""
+    return len(text.encode('utf-8')), len(encode(text))
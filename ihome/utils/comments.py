@@ -0,0 +1,111 @@
+# -*- coding:utf-8 -*-
+"""
+房屋评论缓存
+房屋详情缓存house_info_<id>中只保存房屋本身的数据,评论单独保存在列表house_comments_<id>中,
+按评价时间倒序,最多HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS条;house_comments_loaded_<id>标记列表已经从数据库加载
+(没有评论的房屋列表不存在,需要使用该标记区分).
+发表评价时在列表头部插入并裁剪,不需要删除房屋详情缓存;读取详情时把评论拼接到房屋数据中.
+每次发表评价或者重新加载列表时增加版本号house_comments_version_<id>.从数据库加载评论的请求在查询前读取版本号,
+写入时版本号已经变化,说明查询期间有新的评价提交,查询结果可能缺少该评价,放弃写入,由下一次读取重新加载.
+版本号同时是房屋详情ETag的一部分,验证ETag时不需要读取评论.
+"""
+
+import json
+
+from ihome import constants, redis_store
+from ihome.utils.queries import house_comments
+
+# 增加版本号;列表已经加载时,在头部插入评论并裁剪到展示数量,未加载时不插入,读取时会从数据库加载完整的评论
+_PUSH_SCRIPT = """
+redis.call('incr', KEYS[3])
+if redis.call('exists', KEYS[2]) == 1 then
+    redis.call('lpush', KEYS[1], ARGV[1])
+    redis.call('ltrim', KEYS[1], 0, tonumber(ARGV[2]) - 1)
+    return 1
+end
+return 0
+"""
+
+# 版本号与查询前读取的版本号一致时才写入评论列表和已加载标记;写入后增加版本号,
+# 重新加载的评论可能与之前不同(如评价用户修改了用户名),房屋详情的ETag随之变化
+_LOAD_SCRIPT = """
+if (redis.call('get', KEYS[3]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('del', KEYS[1])
+if #ARGV > 2 then
+    redis.call('rpush', KEYS[1], unpack(ARGV, 3))
+    redis.call('expire', KEYS[1], tonumber(ARGV[2]))
+end
+redis.call('setex', KEYS[2], tonumber(ARGV[2]), 1)
+redis.call('incr', KEYS[3])
+return 1
+"""
+
+
+def comments_key(house_id):
+    """房屋评论列表的键"""
+    return 'house_comments_%s' % house_id
+
+
+def _loaded_key(house_id):
+    """房屋评论列表已加载的标记"""
+    return 'house_comments_loaded_%s' % house_id
+
+
+def version_key(house_id):
+    """房屋评论列表的版本号,每次发表评价或者重新加载列表时增加"""
+    return 'house_comments_version_%s' % house_id
+
+
+def push(house_id, comment_json):
+    """发表评价后把评论插入到房屋评论列表的头部,并增加版本号"""
+    redis_store.eval(_PUSH_SCRIPT, 3, comments_key(house_id), _loaded_key(house_id), version_key(house_id),
+                     comment_json, constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS)
+
+
+def versions(house_ids):
+    """从数据库查询评论之前读取房屋评论列表的版本号,返回{房屋id:版本号},没有版本号时为空字符串"""
+    if not house_ids:
+        return {}
+    return dict((house_id, version or '')
+                for house_id, version in zip(house_ids, redis_store.mget([version_key(house_id) for house_id in house_ids])))
+
+
+def load(house_id, comment_jsons, version):
+    """
+    把从数据库查询出的评论写入房屋评论列表,comment_jsons按评价时间倒序,
+    version为查询前读取的版本号,版本号已经变化时不写入,返回是否写入
+    """
+    return bool(redis_store.eval(_LOAD_SCRIPT, 3, comments_key(house_id), _loaded_key(house_id), version_key(house_id),
+                                 version, constants.HOUSE_COMMENTS_REDIS_EXPIRES, *comment_jsons))
+
+
+def get_comments(house_ids):
+    """
+    获取多个房屋的评论,返回{房屋id:[评论的json字符串]}
+    列表未加载的房屋使用一条sql批量查询,并写入缓存
+    """
+    pip = redis_store.pipeline(transaction=False)
+    for house_id in house_ids:
+        pip.exists(_loaded_key(house_id))
+        pip.lrange(comments_key(house_id), 0, constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS - 1)
+        pip.get(version_key(house_id))
+    results = pip.execute()
+    comments = {}
+    missing_versions = {}
+    for index, house_id in enumerate(house_ids):
+        if results[index * 3]:
+            comments[house_id] = results[index * 3 + 1]
+        else:
+            missing_versions[house_id] = results[index * 3 + 2] or ''
+    if missing_versions:
+        for house_id, orders in house_comments(list(missing_versions)).items():
+            comments[house_id] = [json.dumps(order.to_comment_dict()) for order in orders]
+            load(house_id, comments[house_id], missing_versions[house_id])
+    return comments
+
+
+def with_comments(house_json, comment_jsons):
+    """把评论拼接到房屋详情数据(json对象字符串)的comments字段中"""
+    return '%s, "comments": [%s]}' % (house_json[:-1], ','.join(comment_jsons))
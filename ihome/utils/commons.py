@@ -1,8 +1,11 @@
 # -*- coding:utf-8 -*-
 
+import base64
 import functools
+import json
 
 from flask import g, session, jsonify
+from sqlalchemy import and_, or_
 from werkzeug.routing import BaseConverter
 from ihome.utils.response_code import RET
 
@@ -27,3 +30,18 @@ def login_required(f):
     return wrapper
 
 
+def encode_cursor(*values):
+    """把键集分页的最后一条记录的排序值编码为不透明的游标字符串"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """解码游标字符串,返回编码时的排序值列表"""
+    return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+
+
+def keyset_filter(column, id_column, value, last_id, desc):
+    """键集分页的过滤条件:排序在(value,last_id)之后的记录,id作为排序值相同时的次级排序"""
+    if desc:
+        return or_(column < value, and_(column == value, id_column < last_id))
+    return or_(column > value, and_(column == value, id_column > last_id))
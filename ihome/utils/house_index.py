@@ -0,0 +1,106 @@
+# -*- coding:utf-8 -*-
+"""
+房屋列表排序索引
+每个城区以及全部城区各维护一组redis有序集合,键为house_index_<索引名>_<area_id|all>,
+成员为房屋id,分值为排序值:new为发布时间戳,booking为完成订单数,price为价格.
+房屋列表页直接从有序集合中按分值取出当前页的房屋id,不再在mysql中排序和分页.
+"""
+
+import time
+
+from ihome import db, redis_store
+from ihome.models import House
+from ihome.utils import order_counter
+
+# 房屋列表的排序条件对应的有序集合,以及是否降序
+SORT_INDEXES = {
+    'new': ('new', True),
+    'booking': ('booking', True),
+    'price-inc': ('price', False),
+    'price-des': ('price', True),
+}
+
+
+def index_key(index_name, area_id):
+    """有序集合的键,area_id为空表示全部城区"""
+    return 'house_index_%s_%s' % (index_name, area_id or 'all')
+
+
+def _sort_index(sort_key):
+    """排序条件对应的有序集合和排序方向,未知的排序条件按默认排序处理"""
+    return SORT_INDEXES.get(sort_key, SORT_INDEXES['new'])
+
+
+def _scores(house, order_count_delta=0):
+    """房屋在各个有序集合中的分值,order_count_delta为完成订单数尚未写入数据库的增量"""
+    return {
+        'new': time.mktime(house.create_time.timetuple()),
+        'booking': (house.order_count or 0) + order_count_delta,
+        'price': house.price or 0,
+    }
+
+
+def is_ready():
+    """排序索引是否已经完整构建,未构建时调用方需要回退到数据库查询"""
+    return bool(redis_store.get('house_index_ready'))
+
+
+def _queue_house(pip, house, order_count_delta=0):
+    """把房屋写入所属城区以及全部城区的有序集合"""
+    for index_name, score in _scores(house, order_count_delta).items():
+        for area_id in (house.area_id, None):
+            pip.zadd(index_key(index_name, area_id), score, house.id)
+
+
+def add_house(house):
+    """房屋发布或者修改后更新排序索引"""
+    pip = redis_store.pipeline()
+    _queue_house(pip, house)
+    pip.execute()
+
+
+def incr_order_count(house, amount=1):
+    """房屋的完成订单数变化后更新按成交次数排序的索引"""
+    pip = redis_store.pipeline()
+    for area_id in (house.area_id, None):
+        pip.zincrby(index_key('booking', area_id), house.id, amount)
+    pip.execute()
+
+
+def count(area_id):
+    """城区内的房屋数量"""
+    return redis_store.zcard(index_key('new', area_id))
+
+
+def range_ids(area_id, sort_key, start=0, stop=-1):
+    """按排序条件获取城区内排名在[start,stop]之间的房屋id"""
+    index_name, desc = _sort_index(sort_key)
+    key = index_key(index_name, area_id)
+    if desc:
+        members = redis_store.zrevrange(key, start, stop)
+    else:
+        members = redis_store.zrange(key, start, stop)
+    return [int(member) for member in members]
+
+
+def rebuild():
+    """根据数据库中的房屋数据重建排序索引"""
+    redis_store.delete('house_index_ready')
+    area_ids = [area_id for area_id, in db.session.query(House.area_id).distinct()]
+    pip = redis_store.pipeline()
+    for index_name in set(index_name for index_name, desc in SORT_INDEXES.values()):
+        for area_id in area_ids + [None]:
+            pip.delete(index_key(index_name, area_id))
+    pip.execute()
+    pip = redis_store.pipeline(transaction=False)
+    deltas = order_counter.pending_all()
+    houses = House.query.yield_per(1000)
+    house_count = 0
+    for house in houses:
+        _queue_house(pip, house, deltas.get(house.id, 0))
+        house_count += 1
+        if len(pip) >= 10000:
+            pip.execute()
+    pip.execute()
+    redis_store.set('house_index_ready', 1)
+    return house_count
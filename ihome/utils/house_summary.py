@@ -0,0 +1,79 @@
+# -*- coding:utf-8 -*-
+"""
+房屋摘要缓存
+每个房屋的to_basic_dict保存在house_summary_<id>中(使用codec编码),房屋列表页缓存只保存排好序的房屋id,
+读取列表页时一次MGET取出当前页全部房屋的摘要,缺失的摘要使用一条sql批量查询后写回缓存.
+同一个房屋的摘要被所有城区、日期、排序条件的列表页共享,房屋信息变化时只需要删除该房屋的摘要.
+删除摘要的同时增加房屋摘要的版本号house_summary_version_<id>,列表页的ETag由页面中各房屋摘要的版本号计算,
+验证ETag时不需要读取摘要.
+"""
+
+import json
+
+from flask import current_app
+
+from ihome import constants, redis_store, redis_binary_store
+from ihome.models import House
+from ihome.utils import codec, order_counter
+from ihome.utils.queries import house_basic_query
+
+
+def summary_key(house_id):
+    """房屋摘要缓存的键"""
+    return 'house_summary_%s' % house_id
+
+
+def version_key(house_id):
+    """房屋摘要的版本号,每次删除房屋摘要缓存时增加"""
+    return 'house_summary_version_%s' % house_id
+
+
+def versions(house_ids):
+    """按house_ids的顺序返回房屋摘要的版本号列表,没有版本号时为'0'"""
+    if not house_ids:
+        return []
+    return [version or '0' for version in redis_store.mget([version_key(house_id) for house_id in house_ids])]
+
+
+def build_summaries(house_ids):
+    """使用一条sql批量查询房屋摘要并写入缓存,返回{房屋id:json字符串}"""
+    summaries = {}
+    # 完成订单数加上尚未写入数据库的增量
+    deltas = order_counter.pending(house_ids)
+    pip = redis_store.pipeline(transaction=False)
+    for house in house_basic_query().filter(House.id.in_(house_ids)):
+        house_dict = house.to_basic_dict()
+        house_dict['order_count'] = (house.order_count or 0) + deltas.get(house.id, 0)
+        summaries[house.id] = json.dumps(house_dict)
+        pip.setex(summary_key(house.id), constants.HOUSE_SUMMARY_REDIS_EXPIRES, codec.encode(summaries[house.id]))
+    try:
+        pip.execute()
+    except Exception as e:
+        current_app.logger.error(e)
+    return summaries
+
+
+def get_summaries(house_ids):
+    """按house_ids的顺序返回房屋摘要的json字符串列表,已不存在的房屋被跳过"""
+    if not house_ids:
+        return []
+    try:
+        values = redis_binary_store.mget([summary_key(house_id) for house_id in house_ids])
+    except Exception as e:
+        current_app.logger.error(e)
+        values = [None] * len(house_ids)
+    summaries = dict((house_id, codec.decode(value)) for house_id, value in zip(house_ids, values))
+    missing_ids = [house_id for house_id in house_ids if summaries[house_id] is None]
+    if missing_ids:
+        summaries.update(build_summaries(missing_ids))
+    return [summaries[house_id] for house_id in house_ids if summaries[house_id] is not None]
+
+
+def invalidate(*house_ids):
+    """房屋信息变化后删除房屋摘要缓存,并增加房屋摘要的版本号"""
+    if house_ids:
+        pip = redis_store.pipeline()
+        pip.delete(*[summary_key(house_id) for house_id in house_ids])
+        for house_id in house_ids:
+            pip.incr(version_key(house_id))
+        pip.execute()
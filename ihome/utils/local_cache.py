@@ -0,0 +1,113 @@
+# -*- coding:utf-8 -*-
+"""
+进程内的一级缓存
+城区、设施这类几乎不变的数据,每次请求都访问redis也要付出一次网络往返.
+一级缓存保存在进程内存中,容量有限,按最近最少使用(LRU)淘汰,并且有过期时间;
+数据变化时通过redis的发布订阅通知所有进程删除各自的一级缓存.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from ihome import constants, redis_store
+
+# 删除一级缓存的发布订阅频道
+INVALIDATE_CHANNEL = 'local_cache_invalidate'
+
+
+class LocalCache(object):
+    """有容量上限和过期时间的LRU缓存,线程安全"""
+
+    def __init__(self, max_size, expires):
+        self.max_size = max_size
+        self.expires = expires
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """获取缓存,不存在或者已过期时返回None"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[1] < time.time():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            # 移动到末尾,表示最近使用过
+            value = self._data.pop(key)[0]
+            self._data[key] = (value, item[1])
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires=None):
+        """写入缓存,超过容量时淘汰最久未使用的数据"""
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.time() + (expires or self.expires))
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def stats(self):
+        """命中次数、未命中次数和当前条目数"""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+
+_cache = LocalCache(constants.LOCAL_CACHE_MAX_SIZE, constants.LOCAL_CACHE_EXPIRES)
+
+# 订阅删除通知的线程,每个进程启动一个
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _listen():
+    """接收其它进程发布的删除通知,删除本进程的一级缓存"""
+    pubsub = redis_store.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(INVALIDATE_CHANNEL)
+    for message in pubsub.listen():
+        _cache.delete(message['data'])
+
+
+def _ensure_listener():
+    """首次使用一级缓存时启动订阅线程,多进程部署时在各自的进程中启动"""
+    global _listener
+    if _listener is not None and _listener.is_alive():
+        return
+    with _listener_lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = threading.Thread(target=_listen, name='local-cache-invalidate')
+            _listener.daemon = True
+            _listener.start()
+
+
+def get(key):
+    """获取一级缓存"""
+    try:
+        _ensure_listener()
+    except Exception as e:
+        current_app.logger.error(e)
+    return _cache.get(key)
+
+
+def set(key, value, expires=None):
+    """写入一级缓存"""
+    _cache.set(key, value, expires)
+
+
+def invalidate(key):
+    """删除所有进程中的一级缓存"""
+    _cache.delete(key)
+    redis_store.publish(INVALIDATE_CHANNEL, key)
+
+
+def stats():
+    """本进程一级缓存的命中统计"""
+    return _cache.stats()
@@ -0,0 +1,72 @@
+# -*- coding:utf-8 -*-
+"""
+房屋完成订单数的延迟写入计数器
+订单完成时不再在订单事务中读取并修改房屋的order_count,而是在redis哈希house_order_count_delta中
+对该房屋的字段执行HINCRBY;定时执行python manage.py flush_order_count,把累计的增量批量写入mysql.
+读取完成订单数时使用数据库中的值加上尚未写入的增量.
+"""
+
+from sqlalchemy import bindparam
+
+from ihome import db, redis_store
+from ihome.models import House
+
+# 尚未写入数据库的增量
+DELTA_KEY = 'house_order_count_delta'
+
+# 正在写入数据库的增量,写入完成后删除;写入失败时保留,下次执行时先写入
+FLUSHING_KEY = 'house_order_count_flushing'
+
+
+def incr(house_id, amount=1):
+    """房屋的完成订单数增加amount"""
+    redis_store.hincrby(DELTA_KEY, house_id, amount)
+
+
+def pending(house_ids):
+    """房屋尚未写入数据库的增量,返回{房屋id:增量}"""
+    if not house_ids:
+        return {}
+    pip = redis_store.pipeline(transaction=False)
+    pip.hmget(DELTA_KEY, house_ids)
+    pip.hmget(FLUSHING_KEY, house_ids)
+    deltas, flushing = pip.execute()
+    return dict((house_id, int(delta or 0) + int(flushing_delta or 0))
+                for house_id, delta, flushing_delta in zip(house_ids, deltas, flushing))
+
+
+def pending_all():
+    """全部房屋尚未写入数据库的增量,返回{房屋id:增量}"""
+    pip = redis_store.pipeline(transaction=False)
+    pip.hgetall(DELTA_KEY)
+    pip.hgetall(FLUSHING_KEY)
+    result = {}
+    for deltas in pip.execute():
+        for house_id, delta in deltas.items():
+            result[int(house_id)] = result.get(int(house_id), 0) + int(delta)
+    return result
+
+
+def flush():
+    """把累计的增量批量写入数据库,返回写入的房屋数量"""
+    # 上次写入失败时FLUSHING_KEY仍然存在,先写入这部分增量;否则把当前的增量整体转移过来,之后的增量写入新的哈希
+    if not redis_store.exists(FLUSHING_KEY):
+        # 没有需要写入的增量
+        if not redis_store.exists(DELTA_KEY):
+            return 0
+        redis_store.rename(DELTA_KEY, FLUSHING_KEY)
+    deltas = redis_store.hgetall(FLUSHING_KEY)
+    params = [{'house_id': int(house_id), 'delta': int(delta)} for house_id, delta in deltas.items() if int(delta)]
+    if params:
+        table = House.__table__
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('house_id'))
+            .values(order_count=table.c.order_count + bindparam('delta')),
+            params)
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    redis_store.delete(FLUSHING_KEY)
+    return len(params)
@@ -0,0 +1,87 @@
+# -*- coding:utf-8 -*-
+"""
+只读查询设施
+to_basic_dict/to_full_dict/Order.to_dict会访问关联对象,直接使用Model.query时每条记录都会触发一次懒加载查询.
+这里的查询预先加载这些关联对象,一页数据的查询次数与条目数无关;
+同时提供按请求统计sql执行次数的计数器,用来验证查询次数.
+"""
+
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import contains_eager, joinedload, subqueryload
+
+from ihome import constants, db
+from ihome.models import House, Order, OrderArchive
+
+
+def house_basic_query():
+    """房屋列表使用的查询,同时加载to_basic_dict需要的城区和房东"""
+    return House.query.options(joinedload('area'), joinedload('user'))
+
+
+def house_full_query():
+    """房屋详情使用的查询,同时加载to_full_dict需要的房东、图片和设施"""
+    return House.query.options(joinedload('user'), subqueryload('images'), subqueryload('facilities'))
+
+
+def order_query(model=Order):
+    """订单列表使用的查询,同时加载Order.to_dict需要的房屋,model为OrderArchive时查询归档的订单"""
+    return model.query.options(joinedload('house'))
+
+
+def landlord_order_query(user_id, model=Order):
+    """房东收到的订单,通过房屋表关联房东,同时使用关联查询中的房屋数据填充Order.house"""
+    return model.query.join(model.house).options(contains_eager(model.house)).filter(House.user_id == user_id)
+
+
+def _comments_query(model, house_id, limit):
+    """房屋最新的limit条评论订单,按评价时间倒序,使用(house_id,status,update_time)联合索引"""
+    return model.query.filter(model.house_id == house_id, model.status == 'COMPLETE', model.comment != None)\
+        .order_by(model.update_time.desc()).limit(limit)
+
+
+def _latest_comments(model, house_ids, comments):
+    """
+    查询多个房屋最新的评论订单,追加到comments{房屋id:[订单]}中,每个房屋最多HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS条;
+    单个房屋直接使用ORDER BY ... LIMIT,多个房屋使用UNION ALL合并每个房屋的LIMIT子查询,都只执行一条sql
+    """
+    queries = [_comments_query(model, house_id, constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS - len(comments[house_id]))
+               for house_id in house_ids]
+    if len(queries) == 1:
+        orders = queries[0]
+    else:
+        orders = queries[0].union_all(*queries[1:]).order_by(model.house_id, model.update_time.desc())
+    for order in orders.options(joinedload('user')):
+        comments[order.house_id].append(order)
+
+
+def house_comments(house_ids):
+    """
+    查询多个房屋的评论订单,每个房屋最多HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS条,按评价时间倒序,返回{房屋id:[订单]}
+    归档的订单都早于订单表中的订单,只有订单表中的评论不足展示数量的房屋才查询归档表
+    """
+    comments = dict((house_id, []) for house_id in house_ids)
+    _latest_comments(Order, house_ids, comments)
+    archive_ids = [house_id for house_id in house_ids
+                   if len(comments[house_id]) < constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS]
+    if archive_ids:
+        _latest_comments(OrderArchive, archive_ids, comments)
+    return comments
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    """每执行一条sql,当前请求的查询次数加1"""
+    if has_app_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+def install_query_counter():
+    """为所有数据库引擎注册查询计数器"""
+    if not event.contains(Engine, 'before_cursor_execute', _count_query):
+        event.listen(Engine, 'before_cursor_execute', _count_query)
+
+
+def get_query_count():
+    """当前请求已经执行的sql次数"""
+    return g.get('query_count', 0)
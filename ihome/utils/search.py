@@ -0,0 +1,97 @@
+# -*- coding:utf-8 -*-
+"""
+房屋关键字搜索的倒排索引
+对房屋标题和地址分词:连续的中文按单字和相邻两字(bigram)切分,英文和数字按整个单词切分并转为小写.
+每个词在redis中对应一个集合house_search_<词>,成员为包含该词的房屋id;
+搜索时对关键字使用同样的分词,求所有词集合的交集,不需要在mysql中执行LIKE '%关键字%'扫描.
+倒排索引由python manage.py rebuild_search_index构建,构建完成后设置house_search_index_ready标记;
+标记不存在时索引不完整,调用方需要回退到数据库查询.
+"""
+
+import re
+
+from ihome import redis_store
+from ihome.models import House
+
+# 中文字符的连续片段,以及英文数字单词
+TOKEN_PATTERN = re.compile(u'[一-鿿]+|[0-9a-z]+')
+
+# 倒排索引已完整构建的标记,词中不包含下划线,不会与词的集合的键冲突
+READY_KEY = 'house_search_index_ready'
+
+
+def tokenize(text):
+    """把文本切分为词的集合"""
+    tokens = set()
+    if not text:
+        return tokens
+    for segment in TOKEN_PATTERN.findall(text.lower()):
+        if u'一' <= segment[0] <= u'鿿':
+            tokens.update(segment)
+            tokens.update(segment[i:i + 2] for i in range(len(segment) - 1))
+        else:
+            tokens.add(segment)
+    return tokens
+
+
+def _query_tokens(keyword):
+    """
+    关键字的检索词:中文片段使用相邻两字,只有一个字时使用单字;
+    索引中同时保存了单字和两字,两字的集合更小,交集更快
+    """
+    tokens = set()
+    for segment in TOKEN_PATTERN.findall(keyword.lower()):
+        if u'一' <= segment[0] <= u'鿿' and len(segment) > 1:
+            tokens.update(segment[i:i + 2] for i in range(len(segment) - 1))
+        else:
+            tokens.add(segment)
+    return tokens
+
+
+def token_key(token):
+    """词对应的房屋集合的键"""
+    return u'house_search_%s' % token
+
+
+def _house_tokens_key(house_id):
+    """房屋已索引的词的集合,重新索引时用来移除旧的词"""
+    return 'house_search_tokens_%s' % house_id
+
+
+def index_house(house):
+    """把房屋的标题和地址写入倒排索引,房屋发布或者修改后调用"""
+    tokens = tokenize(house.title) | tokenize(house.address)
+    old_tokens = redis_store.smembers(_house_tokens_key(house.id))
+    pip = redis_store.pipeline()
+    for token in old_tokens - tokens:
+        pip.srem(token_key(token), house.id)
+    for token in tokens:
+        pip.sadd(token_key(token), house.id)
+    pip.delete(_house_tokens_key(house.id))
+    if tokens:
+        pip.sadd(_house_tokens_key(house.id), *tokens)
+    pip.execute()
+
+
+def is_ready():
+    """倒排索引是否已经完整构建"""
+    return bool(redis_store.get(READY_KEY))
+
+
+def search(keyword):
+    """搜索标题或地址中包含关键字的房屋,返回房屋id的集合"""
+    tokens = _query_tokens(keyword)
+    if not tokens:
+        return set()
+    return set(int(house_id) for house_id in redis_store.sinter([token_key(token) for token in tokens]))
+
+
+def rebuild():
+    """根据数据库中的房屋数据重建倒排索引"""
+    redis_store.delete(READY_KEY)
+    count = 0
+    for house in House.query.yield_per(1000):
+        index_house(house)
+        count += 1
+    redis_store.set(READY_KEY, 1)
+    return count
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*-
 #项目启动文件
-from ihome import create_app, db
+from ihome import create_app, db, constants
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 from ihome import models
@@ -11,9 +11,190 @@ app = create_app("development")
 Migrate(app, db)
 manager = Manager(app)
 manager.add_command("db", MigrateCommand)
+# 缓存管理命令:python manage.py cache warm
+cache_manager = Manager(usage='缓存管理')
+manager.add_command("cache", cache_manager)
+
+
+@manager.command
+def rebuild_calendar():
+    """根据订单数据重建房屋可预订状态位图索引"""
+    from ihome.utils import availability
+    count = availability.rebuild()
+    print('已重建%s个房屋的可预订状态位图' % count)
+
+
+@manager.command
+def rebuild_house_index():
+    """根据房屋数据重建房屋列表排序索引"""
+    from ihome.utils import house_index
+    count = house_index.rebuild()
+    print('已重建%s个房屋的排序索引' % count)
+
+
+
+@manager.command
+def rebuild_search_index():
+    """根据房屋数据重建房屋关键字搜索的倒排索引"""
+    from ihome.utils import search
+    count = search.rebuild()
+    print('已重建%s个房屋的搜索索引' % count)
+
+
+
+@manager.command
+def invalidate_reference_cache():
+    """城区或设施数据修改后,删除redis缓存以及所有进程的一级缓存"""
+    from ihome import redis_store
+    from ihome.utils import local_cache
+    for key in ('area_info', 'facility_info'):
+        redis_store.delete(key, 'etag_%s' % key)
+        local_cache.invalidate(key)
+    print('已删除城区和设施信息缓存')
+
+
+@manager.command
+def compare_cache_codec():
+    """统计redis中的缓存数据使用json和编码(超过长度时压缩)后分别占用的字节数"""
+    from ihome import redis_binary_store
+    from ihome.utils import codec
+    json_size, encoded_size, count = 0, 0, 0
+    for pattern in ('area_info', 'facility_info', 'home_page_data', 'house_info_*', 'house_summary_*', 'houses_*'):
+        for key in redis_binary_store.scan_iter(pattern):
+            key_type = redis_binary_store.type(key)
+            if key_type == b'string':
+                values = [redis_binary_store.get(key)]
+            elif key_type == b'hash':
+                values = redis_binary_store.hgetall(key).values()
+            else:
+                continue
+            for value in values:
+                sizes = codec.sizes(codec.decode(value))
+                json_size += sizes[0]
+                encoded_size += sizes[1]
+                count += 1
+    print('缓存数据%s条,json共%s字节,编码后共%s字节' % (count, json_size, encoded_size))
+
+
+@manager.command
+def flush_order_count():
+    """把redis中累计的房屋完成订单数增量批量写入数据库,需要定时执行"""
+    from ihome.utils import order_counter
+    count = order_counter.flush()
+    print('已更新%s个房屋的完成订单数' % count)
+
+
+@manager.option('-d', '--days', dest='days', type=int, default=constants.ORDER_ARCHIVE_DAYS,
+                help='归档结束日期早于多少天前的订单')
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=constants.ORDER_ARCHIVE_BATCH_SIZE,
+                help='每批归档的订单数')
+def archive_orders(days, batch_size):
+    """把早已结束的已完成、已取消、已拒单订单分批转移到归档表,需要定时执行"""
+    from ihome.utils import archive
+    count = archive.archive_orders(days, batch_size)
+    print('已归档%s个订单' % count)
+
+
+@manager.option('-t', '--threads', dest='threads', type=int, default=50, help='并发线程数')
+@manager.option('-r', '--requests', dest='requests', type=int, default=1000, help='预订请求总数')
+@manager.option('-e', '--engine', dest='engine', default='bitmap', choices=['bitmap', 'row_lock'],
+                help='下单接口检查冲突的方式:bitmap使用redis位图,row_lock使用数据库行锁')
+@manager.option('-i', '--house-ids', dest='house_ids', required=True, help='参与测试的真实房屋id,多个用逗号分隔')
+def stress_reservation(threads, requests, engine, house_ids):
+    """
+    并发预订压力测试:通过下单接口并发预订房屋,每个房屋的全部请求预订同一日期,只能有一个请求成功,
+    并统计每秒处理的预订请求数;测试结束后删除产生的订单并释放日期
+    """
+    import datetime
+    import json
+    import random
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from ihome.models import House, Order, User
+    from ihome.utils import availability
+    from ihome.utils.cache import invalidate_houses_list
+    from ihome.utils.response_code import RET
+    if engine == 'bitmap' and not availability.is_ready():
+        print('bitmap模式需要先执行python manage.py rebuild_calendar构建房屋可预订状态位图')
+        return
+    houses = House.query.filter(House.id.in_([int(house_id) for house_id in house_ids.split(',')])).all()
+    if not houses:
+        print('房屋不存在')
+        return
+    # 房东不能预订自己的房屋,每个房屋使用其他用户的登录状态发送请求
+    landlord_ids = set(house.user_id for house in houses)
+    user_ids = [user_id for user_id, in db.session.query(User.id).filter(User.id.notin_(landlord_ids)).limit(threads)]
+    db.session.rollback()
+    if not user_ids:
+        print('没有可以预订这些房屋的用户')
+        return
+    # 每个房屋使用很久以后的随机日期,不与真实订单冲突
+    dates = {}
+    for house in houses:
+        begin_date = datetime.date.today() + datetime.timedelta(days=3650 + random.randint(0, 3650))
+        dates[house.id] = (begin_date, begin_date + datetime.timedelta(days=2))
+
+    def book(house_id):
+        begin_date, end_date = dates[house_id]
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = random.choice(user_ids)
+        resp = client.post('/api/v1.0/orders', content_type='application/json', data=json.dumps({
+            "house_id": house_id, "start_date": begin_date.strftime("%Y-%m-%d"),
+            "end_date": end_date.strftime("%Y-%m-%d")}))
+        if resp.status_code != 200:
+            return house_id, None
+        return house_id, json.loads(resp.get_data(as_text=True))['errno']
+
+    # 测试期间使用指定的冲突检查方式,并关闭csrf保护(测试请求没有csrf_token)
+    reservation_engine = constants.HOUSE_RESERVATION_ENGINE
+    csrf_enabled = app.config.get('WTF_CSRF_ENABLED', True)
+    constants.HOUSE_RESERVATION_ENGINE = engine
+    app.config['WTF_CSRF_ENABLED'] = False
+    try:
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(book, [random.choice(list(dates)) for i in range(requests)]))
+        elapsed = time.time() - start
+    finally:
+        constants.HOUSE_RESERVATION_ENGINE = reservation_engine
+        app.config['WTF_CSRF_ENABLED'] = csrf_enabled
+        for house in houses:
+            begin_date, end_date = dates[house.id]
+            Order.query.filter(Order.house_id == house.id, Order.begin_date == begin_date,
+                               Order.end_date == end_date).delete(synchronize_session=False)
+        db.session.commit()
+        for house in houses:
+            availability.release(house.id, *dates[house.id])
+            invalidate_houses_list(house.area_id)
+    successes = [house_id for house_id, errno in results if errno == RET.OK]
+    duplicated = [house_id for house_id in set(successes) if successes.count(house_id) > 1]
+    errors = [house_id for house_id, errno in results if errno not in (RET.OK, RET.DATAERR)]
+    print('%s个请求,耗时%.2f秒,每秒%.0f个;成功%s个,重复预订的房屋%s个,出错%s个' % (
+        requests, elapsed, requests / elapsed, len(successes), len(duplicated), len(errors)))
+
+
+@cache_manager.option('-n', '--top', dest='top', type=int, default=constants.CACHE_WARM_TOP,
+                      help='重放的最热门请求数')
+@cache_manager.option('-c', '--concurrency', dest='concurrency', type=int, default=constants.CACHE_WARM_CONCURRENCY,
+                      help='同时执行的请求数')
+def warm(top, concurrency):
+    """预热缓存:重建城区信息和首页缓存,并按访问次数重放最热门的房屋详情和列表页请求"""
+    from concurrent.futures import ThreadPoolExecutor
+    from ihome.utils.cache import popular_paths, WARM_HEADER
+    paths = ['/api/v1.0/areas', '/api/v1.0/houses/index']
+    paths += [path for path in popular_paths(top) if path not in paths]
+
+    def replay(path):
+        # 通过视图函数写入缓存,缓存已存在时直接命中,不会重复查询数据库
+        with app.test_client() as client:
+            return client.get(path, headers={WARM_HEADER: '1'}).status_code == 200
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(replay, paths))
+    print('已预热%s个请求,失败%s个' % (results.count(True), results.count(False)))
 
 
 if __name__ == '__main__':
     # print(app.url_map)
     manager.run()
-